@@ -1,5 +1,9 @@
 # No Imports Allowed!
 
+import cmath
+import functools
+from array import array
+
 
 def backwards(sound):
     """
@@ -33,6 +37,10 @@ def mix(sound1, sound2, p):
     """
     if(sound1['rate']!=sound2['rate']): # makes sure both have same sampling rate
         return None
+    if _is_compact(sound1, sound2): # bulk path, keeps the result compact too
+        q = 1 - p
+        mixed = array('d', (p*a + q*b for a, b in zip(sound1['samples'], sound2['samples'])))
+        return CompactSound({'rate': sound1['rate'], 'samples': mixed})
     n=min(len(sound1['samples']),len(sound2['samples']))
     mixed=[] # sample list for final sound
     for i in range(n):
@@ -42,14 +50,20 @@ def mix(sound1, sound2, p):
     return new
 
 
-def convolve(sound, kernel):
+def convolve(sound, kernel, method='auto'):
     """
     Implements a convolution on the sound sample list corresponding to the kernel
 
-    Parameters: Sound object, 1xn kernel list
+    Parameters: Sound object, 1xn kernel list, and the method to use: 'direct'
+    for the nested loop, 'fft' for FFT-based overlap-add, or 'auto' to pick the
+    FFT path once the kernel is long enough for it to pay off
 
     Returns: new sound object
     """
+    if method == 'auto':
+        method = 'fft' if len(kernel) >= FFT_KERNEL_THRESHOLD else 'direct'
+    if method == 'fft':
+        return {'rate': sound['rate'], 'samples': fft_convolve(sound['samples'], kernel)}
     con=[] #new sound sample list
     for i in range(len(sound['samples'])+len(kernel)-1): # length of con is kernel length * list lenght -1
         con.append(0)
@@ -60,28 +74,180 @@ def convolve(sound, kernel):
     return new
 
 
-def echo(sound, num_echoes, delay, scale):
+# Kernels at least this long are convolved with the FFT path when method='auto'
+FFT_KERNEL_THRESHOLD = 64
+
+_twiddle_cache = {}
+
+
+def _fft(values, invert=False):
+    """
+    Recursive radix-2 FFT of a list of complex numbers whose length is a power
+    of two.  The inverse transform is left unscaled (the caller divides by n).
+    """
+    n = len(values)
+    if n == 1:
+        return list(values)
+    even = _fft(values[0::2], invert)
+    odd = _fft(values[1::2], invert)
+    key = (n, invert)
+    if key not in _twiddle_cache: # twiddle factors only depend on the size and direction
+        sign = 2j if invert else -2j
+        _twiddle_cache[key] = [cmath.exp(sign * cmath.pi * k / n) for k in range(n // 2)]
+    twiddled = [w * o for w, o in zip(_twiddle_cache[key], odd)]
+    return [e + t for e, t in zip(even, twiddled)] + [e - t for e, t in zip(even, twiddled)]
+
+
+def _fft_size(num_samples, kernel_length):
+    """
+    Pick the FFT length for overlap-add: the power of two that minimizes the
+    transform cost per output sample, never longer than the whole result needs.
+    """
+    longest = 1
+    while longest < num_samples + kernel_length - 1:
+        longest *= 2
+    size = 2
+    while size < 2 * kernel_length:
+        size *= 2
+    best, best_cost = size, None
+    while True:
+        cost = size * size.bit_length() / (size - kernel_length + 1)
+        if best_cost is None or cost < best_cost:
+            best, best_cost = size, cost
+        if size >= longest:
+            return min(best, max(longest, 2))
+        size *= 2
+
+
+@functools.lru_cache(maxsize=8)
+def _kernel_spectrum(kernel, size):
+    """
+    The FFT of a kernel (a tuple) padded with zeros to size.  It is cached, so
+    convolving block after block of a stream with the same kernel (see
+    lab0_tools.convolve_stage) transforms the kernel only once.  The returned
+    list is shared and must not be changed.
+    """
+    return _fft([complex(v) for v in kernel] + [0j] * (size - len(kernel)))
+
+
+def fft_convolve(samples, kernel):
+    """
+    Convolve a list of samples with a kernel using FFT overlap-add.
+
+    The kernel spectrum is computed once (and reused by later calls with the
+    same kernel and size, see _kernel_spectrum); the samples are then cut into blocks,
+    two at a time, packed into the real and imaginary parts of one complex
+    signal (the kernel is real, so the two results come back separated the same
+    way) and each block's result is added into the output.
+
+    Returns a list of len(samples)+len(kernel)-1 floats, equal to the direct
+    convolution up to floating point error.
+    """
+    n = len(samples)
+    k = len(kernel)
+    if n == 0 or k == 0:
+        return [0.0] * max(n + k - 1, 0)
+    size = _fft_size(n, k)
+    block = size - k + 1 # new samples consumed by each transform
+    spectrum = _kernel_spectrum(tuple(kernel), size)
+    scale = 1 / size
+    out = [0.0] * (n + k - 1)
+    for start in range(0, n, 2 * block):
+        first = list(samples[start:start + block])
+        second = list(samples[start + block:start + 2 * block])
+        packed = list(map(complex, first + [0] * (size - len(first)), second + [0] * (size - len(second))))
+        result = _fft([a * b for a, b in zip(_fft(packed), spectrum)], invert=True)
+        end = start + len(first) + k - 1 # results of the first block (real part)
+        out[start:end] = [o + r.real * scale for o, r in zip(out[start:end], result)]
+        if second:
+            begin = start + block # results of the second block (imaginary part)
+            end = begin + len(second) + k - 1
+            out[begin:end] = [o + r.imag * scale for o, r in zip(out[begin:end], result)]
+    return out
+
+
+def echo(sound, num_echoes, delay, scale, threshold=2**-15):
     """
     Adds eacho feature to sound where sound repeats after a period, but scaled down
 
     Parameters: The sound object, the number of echoes, the time delay between start of each echo, and the scale down of each echo
+
+    If num_echoes is None, keep echoing until the echoes of the loudest sample
+    would drop below threshold (by default, less than one step of a 16-bit WAV).
+
+    All echoes are produced in a single pass with a feedback delay line (see
+    _echo_feedback) instead of one pass over the sound per echo.
     """
     sample_delay = round(delay * sound['rate']) # Calculates the number of sample between each echo
-    copy = sound['samples'][:]
-    n=len(copy)
-    new=[]
-    for i in range(sample_delay*num_echoes+n):# This is the total length with the echoes
-        new.append(0)
-    for i in range(n):
-        new[i]=copy[i]
-    scaler=1 #Used to keep track of how much the echo is scaled down
-    for i in range(num_echoes):
-        scaler*=scale   #Each echo is scaled down by the scale each time
-        for j in range(n):
-            new[(i+1)*sample_delay+j]+=scaler*copy[j]
+    copy = list(sound['samples'])
+    if num_echoes is None:
+        num_echoes = _echo_count(max(map(abs, copy), default=0), scale, threshold)
+    if sample_delay == 0: # every echo lands on top of the original
+        factor = sum(scale**i for i in range(num_echoes + 1))
+        return {'rate': sound['rate'], 'samples': [factor * v for v in copy]}
+    if abs(scale) >= 1: # growing echoes would blow up rounding errors in the feedback loop
+        return {'rate': sound['rate'], 'samples': _echo_sparse(copy, num_echoes, sample_delay, scale)}
+    span = sample_delay * (num_echoes + 1) # how far back the first echo that should stop is
+    new = _echo_feedback(copy + [0] * (sample_delay * num_echoes), [0] * span, [0] * sample_delay,
+                         sample_delay, scale, scale**(num_echoes + 1), span)
     d={'rate':sound['rate'],'samples':new}
     return d
-    
+
+
+def _echo_count(peak, scale, threshold):
+    """
+    Number of echoes to keep so that the next one would be quieter than
+    threshold, for a sound whose loudest sample has magnitude peak.
+    """
+    if peak == 0 or scale == 0:
+        return 0
+    if abs(scale) >= 1:
+        raise ValueError('echoes never decay with scale %r' % scale)
+    count = 0
+    level = peak * abs(scale)
+    while level >= threshold:
+        count += 1
+        level *= abs(scale)
+    return count
+
+
+def _echo_sparse(samples, num_echoes, sample_delay, scale):
+    """
+    Add the echoes one at a time (a convolution with a kernel that is zero
+    except every sample_delay taps), for scales where feedback is unstable.
+    """
+    n = len(samples)
+    new = samples + [0] * (sample_delay * num_echoes)
+    scaler = 1
+    for i in range(1, num_echoes + 1):
+        scaler *= scale
+        start = i * sample_delay
+        new[start:start + n] = [a + scaler * b for a, b in zip(new[start:start + n], samples)]
+    return new
+
+
+def _echo_feedback(samples, xs, ys, sample_delay, scale, cancel, span):
+    """
+    Run the echo recurrence over samples and return the new output samples.
+    xs is the input so far (at least span samples) and ys the output so far
+    (at least sample_delay samples); samples and the new output are appended
+    to them in place, so a caller streaming blocks pays for the block only.
+
+    Every output sample is the input plus scale times the output one delay
+    earlier, which adds all echoes at once; subtracting cancel (scale to the
+    power num_echoes+1) times the input span samples earlier stops the echoes
+    after num_echoes.  Outputs one delay apart only depend on each other, so
+    the work is done a delay-sized chunk at a time.
+    """
+    base_x = len(xs)
+    base_y = len(ys)
+    xs.extend(samples)
+    for start in range(0, len(samples), sample_delay):
+        chunk = samples[start:start + sample_delay]
+        prev = ys[base_y + start - sample_delay:base_y + start - sample_delay + len(chunk)]
+        old = xs[base_x + start - span:base_x + start - span + len(chunk)]
+        ys.extend([x + scale*y - cancel*o for x, y, o in zip(chunk, prev, old)])
+    return ys[base_y:]
 
 
 def pan(sound):
@@ -89,6 +255,10 @@ def pan(sound):
     Switches the magnitudes of the left and right sample lists as time increases.
     """
     n=len(sound['left'])
+    if _is_compact(sound):
+        left = array('d', (v * (1 - i / (n-1)) for i, v in enumerate(sound['left'])))
+        right = array('d', (v * i / (n-1) for i, v in enumerate(sound['right'])))
+        return CompactSound({'rate': sound['rate'], 'left': left, 'right': right})
     left=[]
     right=[]
     for i in range(n):
@@ -106,6 +276,13 @@ def remove_vocals(sound):
 
     Returns mono sound object of one sample list without vocals
     """
+    if _is_compact(sound):
+        left, right = sound['left'], sound['right']
+        if isinstance(left, Int16Samples) and isinstance(right, Int16Samples): # subtract the raw integers
+            mono = array('d', ((l - r)/(2**15) for l, r in zip(left.data, right.data)))
+        else:
+            mono = array('d', (l - r for l, r in zip(left, right)))
+        return CompactSound({'rate': sound['rate'], 'samples': mono})
     mono = []
     for i in range(len(sound['left'])):
         mono.append(sound['left'][i]-sound['right'][i]) # takes difference of left and right sample lists
@@ -121,6 +298,38 @@ def bass_boost_kernel(N, scale=0):
     (1/2 + 1/2cos(Omega)) ^ N
 
     Then we scale that piece up and add a copy of the original signal back in.
+
+    Kernels are cached by (N, scale), so asking for the same one again is free.
+    """
+    return list(_bass_boost_kernel(N, scale))
+
+
+@functools.lru_cache(maxsize=32)
+def _bass_boost_kernel(N, scale):
+    """
+    The low-pass part is [0.25, 0.5, 0.25] convolved with itself N times, which
+    is row 2N+2 of Pascal's triangle divided by 4**(N+1); the binomial
+    coefficients are built exactly as integers in O(N) steps instead of N
+    convolutions.
+    """
+    m = 2 * N + 2
+    denominator = 4**(N + 1)
+    kernel = []
+    coefficient = 1 # m choose k
+    for k in range(m + 1):
+        kernel.append(coefficient / denominator * scale)
+        coefficient = coefficient * (m - k) // (k + 1)
+    # at this point, the kernel will be acting as a low-pass filter, scaled up
+    # by the given scale, so add in a value in the middle to get a (delayed)
+    # copy of the original
+    kernel[len(kernel)//2] += 1
+    return tuple(kernel)
+
+
+def _iterative_bass_boost_kernel(N, scale=0):
+    """
+    The original construction of bass_boost_kernel by repeated convolution,
+    kept as the reference for lab0_tools.benchmark_bass_boost_kernel.
     """
     # make this a fake "sound" so that we can use the convolve function
     base = {'rate': 0, 'samples': [0.25, 0.5, 0.25]}
@@ -129,91 +338,260 @@ def bass_boost_kernel(N, scale=0):
         kernel = convolve(kernel, base['samples'])
     kernel = kernel['samples']
 
-    # at this point, the kernel will be acting as a low-pass filter, so we
-    # scale up the values by the given scale, and add in a value in the middle
-    # to get a (delayed) copy of the original
     kernel = [i * scale for i in kernel]
     kernel[len(kernel)//2] += 1
 
     return kernel
 
 
+# compact sounds: the same dictionary interface, but with the sample lists
+# stored in arrays of machine numbers instead of lists of Python floats
+
+class Int16Samples:
+    """
+    A read-only sequence of samples in [-1, 1) stored as 16-bit integers (the
+    same resolution as a 16-bit WAV file), two bytes per sample.  Indexing and
+    iterating give floats, just like a list of samples would.
+    """
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data # array('h') of samples scaled by 2**15
+
+    @classmethod
+    def from_floats(cls, values):
+        return cls(array('h', (max(-2**15, min(2**15-1, round(v * 2**15))) for v in values)))
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return Int16Samples(self.data[index])
+        return self.data[index]/(2**15)
+
+    def __iter__(self):
+        return (i/(2**15) for i in self.data)
+
+    def reverse(self):
+        self.data.reverse()
+
+    def __repr__(self):
+        return 'Int16Samples(%r)' % (list(self),)
+
+
+class CompactSound(dict):
+    """
+    A sound dictionary ('rate' plus 'samples', or 'left' and 'right') whose
+    sample lists are arrays: typecode 'd' stores 8-byte floats (about 4x
+    smaller than a list of floats), typecode 'h' stores 16-bit samples (about
+    16x smaller, rounded to WAV resolution).
+
+    All of the effects above accept it, and mix, pan and remove_vocals return
+    compact sounds (of 'd' samples) when given one.
+    """
+
+    def __init__(self, sound, typecode='d'):
+        super().__init__(rate=sound['rate'])
+        for key in ('samples', 'left', 'right'):
+            if key in sound:
+                self[key] = _compact_samples(sound[key], typecode)
+
+
+def _compact_samples(values, typecode):
+    """
+    Convert a sequence of samples to the storage for the given typecode,
+    without copying if it is already stored that way.
+    """
+    if typecode == 'd':
+        if isinstance(values, array) and values.typecode == 'd':
+            return values
+        return array('d', values)
+    if typecode == 'h':
+        if isinstance(values, Int16Samples):
+            return values
+        return Int16Samples.from_floats(values)
+    raise ValueError('unsupported typecode: %r' % typecode)
+
+
+def _is_compact(*sounds):
+    """
+    Check whether any of the given sounds is a CompactSound.
+    """
+    return any(isinstance(s, CompactSound) for s in sounds)
+
+
 # below are helper functions for converting back-and-forth between WAV files
 # and our internal dictionary representation for sounds
 
 import io
 import wave
 import struct
+import mmap
+
+
+def _decode_frames(data, width):
+    """
+    Convert a buffer of little-endian PCM samples of the given byte width into
+    an array of signed integers, in bulk.  Returns the array together with the
+    full-scale value to divide by to get samples in [-1, 1).
+    """
+    if width == 1: # unsigned bytes; flipping the top bit makes them signed
+        ints = array('b')
+        ints.frombytes(bytes(data).translate(_FLIP_TOP_BIT))
+        return ints, 2**7
+    if width == 3: # widen each sample to 4 bytes, with a zero low byte
+        data = memoryview(data).cast('B')
+        wide = bytearray(len(data) // 3 * 4)
+        wide[1::4] = data[0::3]
+        wide[2::4] = data[1::3]
+        wide[3::4] = data[2::3]
+        data, width = wide, 4
+    ints = array(_PCM_TYPECODES[width])
+    ints.frombytes(data)
+    if _BIG_ENDIAN:
+        ints.byteswap()
+    return ints, 2**(8*width-1)
+
+
+def _encode_frames(values, width):
+    """
+    Convert a list of samples in [-1, 1] (clipped if outside) into little-endian
+    PCM bytes of the given sample width, in bulk.
+    """
+    top = 2**(8*width-1)-1
+    ints = [int(v * top) if -1 <= v <= 1 else (top if v > 0 else -top) for v in values]
+    if width == 1: # 8-bit WAV samples are unsigned
+        return bytes([i + 128 for i in ints])
+    out = array(_PCM_TYPECODES[4 if width == 3 else width], ints)
+    if _BIG_ENDIAN:
+        out.byteswap()
+    if width == 3: # drop the (zero) top byte of each 4-byte sample
+        wide = memoryview(out).cast('B')
+        packed = bytearray(len(ints) * 3)
+        packed[0::3] = wide[0::4]
+        packed[1::3] = wide[1::4]
+        packed[2::3] = wide[2::4]
+        return bytes(packed)
+    return out.tobytes()
+
+
+_FLIP_TOP_BIT = bytes(i ^ 0x80 for i in range(256))
+_PCM_TYPECODES = {2: 'h', 4: 'i' if array('i').itemsize == 4 else 'l'}
+_BIG_ENDIAN = array('H', [1]).tobytes()[0] == 0 # arrays use the machine's byte order
+
+
+def _channels_from_frames(ints, scale, chan, stereo, compact):
+    """
+    Split decoded interleaved integer frames into the sample lists of a sound
+    dictionary (mono or stereo), as lists of floats or as compact storage.
+    """
+    if chan == 2:
+        left, right = ints[0::2], ints[1::2]
+    else:
+        left = right = ints
+    if compact == 'h' and scale == 2**15:
+        wrap = lambda c: Int16Samples(c if chan == 2 else array('h', c)) # the file's own samples, no conversion
+    elif compact:
+        wrap = lambda c: _compact_samples([i/scale for i in c], compact)
+    else:
+        wrap = lambda c: [i/scale for i in c]
+    if stereo:
+        return {'left': wrap(left), 'right': wrap(right)}
+    if chan == 2:
+        if compact:
+            return {'samples': _compact_samples([((l + r)/2)/scale for l, r in zip(left, right)], compact)}
+        return {'samples': [((l + r)/2)/scale for l, r in zip(left, right)]}
+    return {'samples': wrap(left)}
 
-def load_wav(filename, stereo=False):
+
+def _data_chunk(filename):
+    """
+    Memory-map the given WAV file and return a memoryview of its 'data' chunk
+    (along with the map, which must stay open while the view is used).
+    """
+    with open(filename, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    pos = 12 # skip the RIFF header and the 'WAVE' tag
+    while pos + 8 <= len(mapped):
+        chunk, size = struct.unpack('<4sI', mapped[pos:pos + 8])
+        pos += 8
+        if chunk == b'data':
+            return memoryview(mapped)[pos:min(pos + size, len(mapped))], mapped
+        pos += size + (size & 1) # chunks are padded to an even length
+    mapped.close()
+    raise ValueError('no data chunk in %r' % filename)
+
+
+def load_wav(filename, stereo=False, compact=None, memory_map=False):
     """
     Given the filename of a WAV file, load the data from that file and return a
     Python dictionary representing that sound
+
+    8, 16, 24 and 32-bit PCM files are supported.  If compact is 'd' or 'h',
+    return a CompactSound with that storage instead (see CompactSound).  If
+    memory_map is True, the samples are decoded straight out of a memory map of
+    the file instead of being read into memory first.
     """
     f = wave.open(filename, 'r')
     chan, bd, sr, count, _, _ = f.getparams()
 
-    assert bd == 2, "only 16-bit WAV files are supported"
-
-    out = {'rate': sr}
+    assert bd in (1, 2, 3, 4), "only 8, 16, 24 and 32-bit WAV files are supported"
 
-    if stereo:
-        left = []
-        right = []
-        for i in range(count):
-            frame = f.readframes(1)
-            if chan == 2:
-                left.append(struct.unpack('<h', frame[:2])[0])
-                right.append(struct.unpack('<h', frame[2:])[0])
-            else:
-                datum = struct.unpack('<h', frame)[0]
-                left.append(datum)
-                right.append(datum)
-
-        out['left'] = [i/(2**15) for i in left]
-        out['right'] = [i/(2**15) for i in right]
+    if memory_map:
+        f.close()
+        data, mapped = _data_chunk(filename)
+        data = data[:count * chan * bd]
     else:
-        samples = []
-        for i in range(count):
-            frame = f.readframes(1)
-            if chan == 2:
-                left = struct.unpack('<h', frame[:2])[0]
-                right = struct.unpack('<h', frame[2:])[0]
-                samples.append((left + right)/2)
-            else:
-                datum = struct.unpack('<h', frame)[0]
-                samples.append(datum)
-
-        out['samples'] = [i/(2**15) for i in samples]
+        data = f.readframes(count)
+        f.close()
+    ints, scale = _decode_frames(data, bd)
+    if memory_map:
+        data.release()
+        mapped.close()
 
+    out = {'rate': sr}
+    out.update(_channels_from_frames(ints, scale, chan, stereo, compact))
+    if compact:
+        return CompactSound(out, compact)
     return out
 
 
-def write_wav(sound, filename):
+def write_wav(sound, filename, sample_width=2):
     """
     Given a dictionary representing a sound, and a filename, convert the given
     sound into WAV format and save it as a file with the given filename (which
     can then be opened by most audio players)
+
+    sample_width is the number of bytes per sample: 1, 2 (the default), 3 or 4.
     """
     outfile = wave.open(filename, 'w')
 
     if 'samples' in sound:
         # mono file
-        outfile.setparams((1, 2, sound['rate'], 0, 'NONE', 'not compressed'))
-        out = [int(max(-1, min(1, v)) * (2**15-1)) for v in sound['samples']]
+        outfile.setparams((1, sample_width, sound['rate'], 0, 'NONE', 'not compressed'))
+        out = _encode_frames(sound['samples'], sample_width)
     else:
         # stereo
-        outfile.setparams((2, 2, sound['rate'], 0, 'NONE', 'not compressed'))
-        out = []
-        for l, r in zip(sound['left'], sound['right']):
-            l = int(max(-1, min(1, l)) * (2**15-1))
-            r = int(max(-1, min(1, r)) * (2**15-1))
-            out.append(l)
-            out.append(r)
-
-    outfile.writeframes(b''.join(struct.pack('<h', frame) for frame in out))
+        outfile.setparams((2, sample_width, sound['rate'], 0, 'NONE', 'not compressed'))
+        out = _interleave(_encode_frames(sound['left'], sample_width),
+                          _encode_frames(sound['right'], sample_width), sample_width)
+
+    outfile.writeframes(out)
     outfile.close()
 
+
+def _interleave(left, right, width):
+    """
+    Interleave two channels of encoded samples (each width bytes) into stereo
+    frames.
+    """
+    out = bytearray(len(left) + len(right))
+    for i in range(width):
+        out[i::2*width] = left[i::width]
+        out[width+i::2*width] = right[i::width]
+    return bytes(out)
+
 # if __name__ == '__main__':
     # code in this block will only be run when you explicitly run your script,
     # and not when the tests are being run.  this is a good place to put your
@@ -0,0 +1,484 @@
+"""
+Tools built on the lab 0 effects: streaming versions of the effects, batch
+processing of many WAV files in worker processes, benchmarks, and the
+command line.  Run with --help for usage.
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import wave
+import tempfile
+import argparse
+import concurrent.futures
+
+from lab0 import (backwards, mix, convolve, echo, pan, remove_vocals, bass_boost_kernel,
+                  load_wav, write_wav, FFT_KERNEL_THRESHOLD, _fft_size, _bass_boost_kernel,
+                  _iterative_bass_boost_kernel, _echo_feedback, _decode_frames, _encode_frames,
+                  _channels_from_frames, _interleave)
+
+
+# streaming versions of the lab 0 effects: a stream is any iterable of sound
+# dictionaries ("blocks") holding consecutive pieces of one sound, so only a
+# few blocks are ever in memory at once
+
+def stream_wav(filename, stereo=False, block_size=4096, reverse=False):
+    """
+    Given the filename of a WAV file, yield the sound in it as a sequence of
+    blocks of at most block_size samples each (same format as load_wav).
+
+    If reverse is True, the blocks come from the end of the file backwards and
+    each block is reversed, which streams backwards(load_wav(filename)).
+    """
+    f = wave.open(filename, 'r')
+    chan, bd, sr, count, _, _ = f.getparams()
+
+    assert bd in (1, 2, 3, 4), "only 8, 16, 24 and 32-bit WAV files are supported"
+
+    starts = range(0, count, block_size)
+    if reverse:
+        starts = reversed(starts)
+    for start in starts:
+        frames = min(block_size, count - start)
+        if reverse:
+            f.setpos(start)
+        ints, scale = _decode_frames(f.readframes(frames), bd)
+        block = {'rate': sr}
+        block.update(_channels_from_frames(ints, scale, chan, stereo, None))
+        if reverse:
+            for key in ('samples', 'left', 'right'):
+                if key in block:
+                    block[key].reverse()
+        yield block
+    f.close()
+
+
+def wav_length(filename):
+    """
+    Return the number of samples (per channel) in the given WAV file, which
+    pan_stage needs to know up front.
+    """
+    with wave.open(filename, 'r') as f:
+        return f.getnframes()
+
+
+def mix_stage(blocks1, blocks2, p):
+    """
+    Streaming mix: yields blocks of mix(sound1, sound2, p), stopping when the
+    shorter stream runs out.  The two streams do not need the same block size.
+    Yields nothing if the two sampling rates differ.
+    """
+    blocks2 = iter(blocks2)
+    pending = [] # samples of sound2 read but not mixed yet
+    for block in blocks1:
+        samples = block['samples']
+        while len(pending) < len(samples):
+            other = next(blocks2, None)
+            if other is None:
+                break
+            if other['rate'] != block['rate']:
+                return
+            pending.extend(other['samples'])
+        mixed = mix(block, {'rate': block['rate'], 'samples': pending}, p)
+        if mixed is None:
+            return
+        del pending[:len(mixed['samples'])]
+        if mixed['samples']:
+            yield mixed
+        if len(mixed['samples']) < len(samples): # sound2 ran out
+            return
+
+
+def convolve_stage(blocks, kernel):
+    """
+    Streaming convolve: yields blocks of convolve(sound, kernel), carrying the
+    last len(kernel)-1 samples of each result (the convolution tail) over into
+    the next one.
+
+    For kernels long enough to be convolved by FFT, blocks are gathered until
+    there are enough samples for two of fft_convolve's transform blocks (see
+    _fft_size), so small blocks cost no more per sample than the whole sound
+    would; the results are handed back out in the original block sizes.
+    """
+    k = len(kernel)
+    gather = 2 * (_fft_size(1 << 40, k) - k + 1) if k >= FFT_KERNEL_THRESHOLD else 1
+    tail = None
+    rate = None
+    sizes = [] # lengths of the blocks gathered so far
+    samples = []
+
+    def convolve_gathered():
+        nonlocal tail
+        out = convolve({'rate': rate, 'samples': samples}, kernel)['samples']
+        if tail:
+            out[:len(tail)] = [a + b for a, b in zip(out, tail)]
+        tail = out[len(samples):]
+        pieces = []
+        start = 0
+        for n in sizes:
+            pieces.append({'rate': rate, 'samples': out[start:start + n]})
+            start += n
+        return pieces
+
+    for block in blocks:
+        rate = block['rate']
+        sizes.append(len(block['samples']))
+        samples.extend(block['samples'])
+        if len(samples) >= gather:
+            yield from convolve_gathered()
+            sizes, samples = [], []
+    if sizes:
+        yield from convolve_gathered()
+    if tail:
+        yield {'rate': rate, 'samples': tail}
+
+
+def echo_stage(blocks, num_echoes, delay, scale):
+    """
+    Streaming echo: yields blocks of echo(sound, num_echoes, delay, scale).
+    The feedback delay line keeps (at least) the last num_echoes+1 delays of
+    input and the last delay of output; the echoes still ringing when the input ends are
+    flushed at the end.  (The "decay until below threshold" mode of echo needs
+    the whole sound up front, so it is not available here.)
+    """
+    rate = None
+    for block in blocks:
+        if rate is None:
+            rate = block['rate']
+            sample_delay = round(delay * rate)
+            feedback = sample_delay > 0 and abs(scale) < 1 # same choice as echo makes
+            span = sample_delay * (num_echoes + 1)
+            cancel = scale**(num_echoes + 1)
+            x_history, y_history = [0] * span, [0] * sample_delay
+            line = [] # otherwise: output from the current position on, still being added to
+        samples = list(block['samples'])
+        if feedback:
+            out = _echo_feedback(samples, x_history, y_history, sample_delay, scale, cancel, span)
+            # drop old history only once it has doubled, so trimming costs O(1) per sample
+            if len(x_history) > 2 * span:
+                del x_history[:-span]
+            if len(y_history) > 2 * sample_delay:
+                del y_history[:-sample_delay]
+        else:
+            echoed = echo({'rate': rate, 'samples': samples}, num_echoes, delay, scale)['samples']
+            line.extend([0] * (len(echoed) - len(line)))
+            line[:len(echoed)] = [a + b for a, b in zip(line, echoed)]
+            out = line[:len(samples)]
+            del line[:len(samples)]
+        yield {'rate': rate, 'samples': out}
+    if rate is None:
+        return
+    if feedback:
+        line = _echo_feedback([0] * (sample_delay * num_echoes), x_history, y_history,
+                              sample_delay, scale, cancel, span)
+    if line:
+        yield {'rate': rate, 'samples': line}
+
+
+def pan_stage(blocks, length):
+    """
+    Streaming pan for a stereo stream of length samples in total (see
+    wav_length).
+    """
+    i = 0 # position of the first sample of the current block in the whole sound
+    for block in blocks:
+        n = len(block['left'])
+        left = [v * (1 - j / (length - 1)) for j, v in enumerate(block['left'], i)]
+        right = [v * j / (length - 1) for j, v in enumerate(block['right'], i)]
+        i += n
+        yield {'rate': block['rate'], 'left': left, 'right': right}
+
+
+def remove_vocals_stage(blocks):
+    """
+    Streaming remove_vocals: every block is independent, so this just applies
+    remove_vocals to each stereo block.
+    """
+    for block in blocks:
+        yield remove_vocals(block)
+
+
+def write_wav_stream(blocks, filename, sample_width=2):
+    """
+    Write a stream of mono or stereo blocks to the given WAV file as they
+    arrive.  Nothing is written if the stream is empty.
+    """
+    outfile = None
+    for block in blocks:
+        if outfile is None:
+            outfile = wave.open(filename, 'w')
+            channels = 1 if 'samples' in block else 2
+            outfile.setparams((channels, sample_width, block['rate'], 0, 'NONE', 'not compressed'))
+        if 'samples' in block:
+            out = _encode_frames(block['samples'], sample_width)
+        else:
+            out = _interleave(_encode_frames(block['left'], sample_width),
+                              _encode_frames(block['right'], sample_width), sample_width)
+        outfile.writeframes(out)
+    if outfile is not None:
+        outfile.close()
+
+
+# batch processing: the same chain of streaming effects applied to many WAV
+# files, spread over worker processes
+
+BATCH_STEPS = {
+    'bass': 'bass:N:SCALE  convolve with bass_boost_kernel(N, SCALE)',
+    'echo': 'echo:NUM:DELAY:SCALE  echo(sound, NUM, DELAY, SCALE)',
+    'vocals': 'vocals  remove_vocals (needs stereo input, gives mono)',
+    'pan': 'pan  pan (needs stereo input)',
+}
+
+
+def parse_chain(specs):
+    """
+    Turn effect specifications like 'bass:1000:1.5', 'echo:5:0.3:0.6' or
+    'vocals' (see BATCH_STEPS) into a list of (name, arguments) steps that can
+    be sent to worker processes.  Kernels are built here, once per batch.
+    """
+    chain = []
+    stereo = None # whether the sound is stereo going into the next step
+    for spec in specs:
+        name, *args = spec.split(':')
+        if name == 'bass' and len(args) == 2:
+            step = ('convolve', (bass_boost_kernel(int(args[0]), float(args[1])),))
+        elif name == 'echo' and len(args) == 3:
+            step = ('echo', (int(args[0]), float(args[1]), float(args[2])))
+        elif name in ('vocals', 'pan') and not args:
+            step = (name, ())
+        else:
+            raise ValueError('bad effect %r, expected one of: %s' % (spec, '; '.join(BATCH_STEPS.values())))
+        if name in ('vocals', 'pan'):
+            if stereo is False:
+                raise ValueError('%r needs a stereo sound, but an earlier effect made it mono' % spec)
+            stereo = name == 'pan'
+        elif stereo:
+            raise ValueError('%r needs a mono sound, but an earlier effect made it stereo' % spec)
+        else:
+            stereo = False
+        chain.append(step)
+    return chain
+
+
+def process_file(filename, out_filename, chain, block_size=65536):
+    """
+    Stream the given WAV file through a chain of steps from parse_chain and
+    write the result to out_filename.  Returns (filename, number of input
+    samples, seconds taken).
+    """
+    start = time.perf_counter()
+    stereo = bool(chain) and chain[0][0] in ('vocals', 'pan')
+    counted = [0]
+
+    def source():
+        for block in stream_wav(filename, stereo=stereo, block_size=block_size):
+            counted[0] += len(block['left' if stereo else 'samples'])
+            yield block
+
+    blocks = source()
+    for name, args in chain:
+        if name == 'convolve':
+            blocks = convolve_stage(blocks, *args)
+        elif name == 'echo':
+            blocks = echo_stage(blocks, *args)
+        elif name == 'vocals':
+            blocks = remove_vocals_stage(blocks)
+        elif name == 'pan':
+            blocks = pan_stage(blocks, wav_length(filename))
+    write_wav_stream(blocks, out_filename)
+    return filename, counted[0], time.perf_counter() - start
+
+
+def batch_process(filenames, out_dir, chain, workers=None, block_size=65536, report=print):
+    """
+    Apply a chain of steps (from parse_chain) to every WAV file in filenames,
+    writing each result under out_dir with the same base name, using a pool
+    of worker processes (workers=None uses one per core).  Raises ValueError
+    if two of the files have the same base name, since they would be written
+    to the same output file.
+
+    report is called with a line of text as each file finishes.  Returns a
+    dictionary with the number of workers, files, samples, wall-clock
+    seconds and samples per second of the whole batch.
+    """
+    seen = {}
+    for name in filenames:
+        base = os.path.basename(name)
+        if base in seen:
+            raise ValueError('%s and %s would both be written to %s' % (seen[base], name, os.path.join(out_dir, base)))
+        seen[base] = name
+    os.makedirs(out_dir, exist_ok=True)
+    start = time.perf_counter()
+    total = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(process_file, name, os.path.join(out_dir, os.path.basename(name)), chain, block_size)
+                   for name in filenames]
+        for future in concurrent.futures.as_completed(futures):
+            name, samples, seconds = future.result()
+            total += samples
+            report('%s: %d samples in %.3fs (%.0f samples/s)' % (name, samples, seconds, samples / max(seconds, 1e-9)))
+    elapsed = time.perf_counter() - start
+    return {'workers': workers or os.cpu_count(), 'files': len(filenames), 'samples': total,
+            'seconds': elapsed, 'samples_per_second': total / max(elapsed, 1e-9)}
+
+
+# benchmarks: time the effects and the WAV helpers on synthetic sounds of
+# increasing length, and compare the timings against a stored baseline
+
+BENCH_DURATIONS = (1, 10, 60, 600, 3600) # seconds of audio
+
+
+def benchmark_bass_boost_kernel(sizes=(10, 100, 1000), scale=1.5):
+    """
+    Time the iterative and closed-form kernel constructions (and a cache hit)
+    for each N in sizes.  Returns a list of dictionaries with the seconds each
+    took and the largest difference between the two kernels.
+    """
+    results = []
+    for N in sizes:
+        start = time.perf_counter()
+        reference = _iterative_bass_boost_kernel(N, scale)
+        iterative = time.perf_counter() - start
+        _bass_boost_kernel.cache_clear()
+        start = time.perf_counter()
+        kernel = bass_boost_kernel(N, scale)
+        closed_form = time.perf_counter() - start
+        start = time.perf_counter()
+        bass_boost_kernel(N, scale)
+        cached = time.perf_counter() - start
+        results.append({'N': N, 'iterative': iterative, 'closed_form': closed_form, 'cached': cached,
+                        'max_difference': max(abs(a - b) for a, b in zip(reference, kernel))})
+    return results
+
+
+def synthetic_sound(seconds, rate=44100, stereo=False):
+    """
+    Make a deterministic test sound of the given length: a chord of sine waves
+    (a different one in each channel, for stereo sounds).
+    """
+    n = int(seconds * rate)
+    step = 2 * math.pi / rate
+    def tone(*freqs):
+        return [sum(math.sin(f * i * step) for f in freqs) / (len(freqs) + 1) for i in range(n)]
+    if stereo:
+        return {'rate': rate, 'left': tone(220, 277.18, 329.63), 'right': tone(246.94, 311.13, 369.99)}
+    return {'rate': rate, 'samples': tone(220, 277.18, 329.63)}
+
+
+def run_benchmarks(durations=(1, 10, 60), kernel_size=100, repeat=1, report=print):
+    """
+    Time convolve, echo, mix, pan, remove_vocals, load_wav and write_wav on
+    synthetic sounds of each of the given durations (in seconds).  Each timing
+    is the best of repeat runs.  Returns a list of result dictionaries (name,
+    duration, samples, seconds), calling report with a line for each.
+    """
+    kernel = bass_boost_kernel(kernel_size, 1.5)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for duration in durations:
+            mono = synthetic_sound(duration)
+            other = backwards(mono)
+            stereo = synthetic_sound(duration, stereo=True)
+            mono_file = os.path.join(tmp, 'mono.wav')
+            stereo_file = os.path.join(tmp, 'stereo.wav')
+            cases = [
+                ('write_wav', lambda: write_wav(mono, mono_file)),
+                ('write_wav_stereo', lambda: write_wav(stereo, stereo_file)),
+                ('load_wav', lambda: load_wav(mono_file)),
+                ('load_wav_stereo', lambda: load_wav(stereo_file, stereo=True)),
+                ('convolve', lambda: convolve(mono, kernel)),
+                ('echo', lambda: echo(mono, 5, 0.3, 0.6)),
+                ('mix', lambda: mix(mono, other, 0.3)),
+                ('pan', lambda: pan(stereo)),
+                ('remove_vocals', lambda: remove_vocals(stereo)),
+            ]
+            for name, run in cases:
+                best = None
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    run()
+                    seconds = time.perf_counter() - start
+                    best = seconds if best is None else min(best, seconds)
+                results.append({'name': name, 'duration': duration, 'samples': len(mono['samples']), 'seconds': best})
+                report('%-18s %6gs audio: %9.4fs' % (name, duration, best))
+    return results
+
+
+def compare_benchmarks(results, baseline, tolerance=0.2):
+    """
+    Compare benchmark results against baseline results (both as returned by
+    run_benchmarks).  Returns a list of (name, duration, baseline seconds,
+    new seconds) for every case that got more than tolerance (a fraction)
+    slower.
+    """
+    old = {(r['name'], r['duration']): r['seconds'] for r in baseline}
+    slower = []
+    for r in results:
+        key = (r['name'], r['duration'])
+        if key in old and r['seconds'] > old[key] * (1 + tolerance):
+            slower.append((r['name'], r['duration'], old[key], r['seconds']))
+    return slower
+
+
+def main(argv=None):
+    """
+    Command line entry point; run with --help for usage.
+    """
+    parser = argparse.ArgumentParser(description='6.009 lab 0 audio effects')
+    commands = parser.add_subparsers(dest='command', required=True)
+    batch = commands.add_parser('batch', help='apply an effect chain to many WAV files in parallel',
+                                epilog='effects: ' + '; '.join(BATCH_STEPS.values()))
+    batch.add_argument('out_dir', help='directory to write the processed files to')
+    batch.add_argument('files', nargs='+', help='WAV files to process')
+    batch.add_argument('-e', '--effect', action='append', default=[], dest='effects',
+                       help='effect to apply (repeat for a chain, applied in order)')
+    batch.add_argument('-w', '--workers', type=int, nargs='+', default=[None],
+                       help='number of worker processes; several values run the batch once per value')
+    batch.add_argument('--block-size', type=int, default=65536, help='samples per streamed block')
+    bench_kernel = commands.add_parser('bench-kernel', help='time bass_boost_kernel against the iterative construction')
+    bench_kernel.add_argument('sizes', type=int, nargs='*', default=[10, 100, 1000], help='values of N to try')
+    bench = commands.add_parser('bench', help='time the effects on synthetic sounds, optionally against a baseline')
+    bench.add_argument('-d', '--durations', type=float, nargs='+', default=[1, 10, 60],
+                       help='lengths of the test sounds in seconds (up to %g)' % BENCH_DURATIONS[-1])
+    bench.add_argument('-o', '--output', help='JSON file to save the results to')
+    bench.add_argument('-b', '--baseline', help='JSON file of earlier results to compare against')
+    bench.add_argument('-t', '--tolerance', type=float, default=0.2,
+                       help='fraction slower than the baseline that counts as a slowdown')
+    bench.add_argument('-r', '--repeat', type=int, default=1, help='runs per case (the best is kept)')
+    bench.add_argument('-k', '--kernel-size', type=int, default=100, help='N of the bass_boost_kernel to convolve with')
+    args = parser.parse_args(argv)
+
+    if args.command == 'batch':
+        try:
+            chain = parse_chain(args.effects)
+            summaries = [batch_process(args.files, args.out_dir, chain, workers, args.block_size)
+                         for workers in args.workers]
+        except ValueError as e:
+            parser.error(str(e))
+        print('%8s %8s %12s %10s %14s' % ('workers', 'files', 'samples', 'seconds', 'samples/s'))
+        for s in summaries:
+            print('%8d %8d %12d %10.3f %14.0f' % (s['workers'], s['files'], s['samples'], s['seconds'], s['samples_per_second']))
+    elif args.command == 'bench-kernel':
+        print('%8s %12s %12s %12s %14s' % ('N', 'iterative', 'closed form', 'cached', 'max diff'))
+        for r in benchmark_bass_boost_kernel(args.sizes):
+            print('%8d %11.4fs %11.4fs %11.6fs %14.3g' % (r['N'], r['iterative'], r['closed_form'], r['cached'], r['max_difference']))
+    elif args.command == 'bench':
+        results = run_benchmarks(args.durations, args.kernel_size, args.repeat)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump({'python': sys.version, 'platform': sys.platform, 'results': results}, f, indent=2)
+        if args.baseline:
+            with open(args.baseline) as f:
+                baseline = json.load(f)['results']
+            slower = compare_benchmarks(results, baseline, args.tolerance)
+            for name, duration, before, after in slower:
+                print('SLOWER: %s on %gs audio: %.4fs -> %.4fs (%+.0f%%)' % (name, duration, before, after, 100 * (after / before - 1)))
+            if slower:
+                return 1
+            print('no slowdowns beyond %.0f%% against %s' % (100 * args.tolerance, args.baseline))
+
+if __name__ == '__main__':
+    sys.exit(main())
+
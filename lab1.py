@@ -1,12 +1,36 @@
 #!/usr/bin/env python3
 
 import math
+import functools
+from array import array
 
 from PIL import Image as Image
 
 # NO ADDITIONAL IMPORTS ALLOWED!
 
 
+# PROFILING HOOK
+
+# lab1_tools.start_profiling puts a function here that times each call of the
+# stages wrapped by _profiled.  While it is None, a profiled function costs one
+# extra check per call.
+_profiler = None
+
+
+def _profiled(func, name=None):
+    '''
+    Wrap func (a function whose first argument is an image) so that its calls
+    are recorded under name (its own name by default) while profiling is on.
+    '''
+    name = name or func.__name__
+    @functools.wraps(func)
+    def wrapper(image, *args, **kwargs):
+        if _profiler is None:
+            return func(image, *args, **kwargs)
+        return _profiler(name, func, image, args, kwargs)
+    return wrapper
+
+
 def get_pixel(image, x, y):
     '''
     Given an image and the 2d coordinates of a pixel, get_pixel returns the pixel in the 1d pixel array
@@ -36,6 +60,8 @@ def apply_per_pixel(image, func):
             newcolor = func(color) # applies func on the pixel and saves it as another variable in the loop
             result['pixels'].append(newcolor)
 
+    if isinstance(image, CompactImage):
+        return _new_image(image, result['pixels'])
     return result
 
 
@@ -46,9 +72,12 @@ def inverted(image):
     '''
     return apply_per_pixel(image, lambda c: 255-c)
 
+inverted.cascade_step = ('pixel', lambda c: 255-c)
+
 
 # HELPER FUNCTIONS
 
+@_profiled
 def correlate(image, kernel, boundary_behavior):
     """
     Compute the result of correlating the given image with the given kernel.
@@ -69,20 +98,118 @@ def correlate(image, kernel, boundary_behavior):
     separate structure to represent the output.
 
     The kernel is represented by a 2D list (list of lists) corresponding to kernel square matrix structure.
+
+    The work is done on a copy of the image padded once according to
+    boundary_behavior.  Kernels of integers that factor into a column times a
+    row (like the Sobel kernels in edges) are applied to integer images as two
+    1-D passes; everything else is summed in the same order as a direct
+    per-pixel loop, so the result is always identical to one.
     """
-    copy = image['pixels'][:] #New version of pixels for final image
+    if boundary_behavior not in ('zero', 'extend', 'wrap'):
+        return None
     height=image['height']
     width = image['width']
     n = len(kernel)
     k  = int((n-1)/2)
-    for i in range(height):
-        for j in range(width): # These too loops iterate through whole array of pixels
-            copy[width*i+j]=0 #Resets our copied pixel so we can add to it
+    rows = _padded_rows(image, k, n-1-k, boundary_behavior)
+    factors = _integer_factors(kernel)
+    if factors is not None and all(type(p) is int for p in image['pixels']):
+        pixels = _separable_correlate(rows, width, *factors)
+    else:
+        pixels = array('d') if isinstance(image, CompactImage) else [] # compact results are 8-byte floats
+        for i in range(height):
+            acc = [0] * width # running sums for output row i, added to tap by tap
             for a in range(n):
+                row = rows[i+a]
                 for b in range(n):
-                    copy[width*i+j]+=(kernel[a][b])*(getpixel_1(image,i-k+a,j-k+b,boundary_behavior)) #For each pixel, we add each effect of the kernel. getpixel_1 determines output of each kernel effect
-    d={'height':image['height'],'width':image['width'],'pixels':copy}
-    return d
+                    weight = kernel[a][b]
+                    if weight != 0:
+                        acc = [s + weight*p for s, p in zip(acc, row[b:b+width])]
+            pixels.extend(acc)
+    return _new_image(image, pixels, 'd')
+
+
+def _padded_rows(image, before, after, boundary_behavior):
+    '''
+    Returns the image as a list of rows, with before extra rows/columns added on
+    the top and left and after extra ones on the bottom and right, filled in
+    according to boundary_behavior (same rules as getpixel_1).
+    '''
+    height = image['height']
+    width = image['width']
+    pixels = image['pixels']
+    row_map, cols = _boundary_indexes(width, height, before, after, boundary_behavior)
+    padded = [[row[j] for j in cols] for row in (list(pixels[i*width:(i+1)*width]) + [0] for i in range(height))]
+    return [padded[i] if i >= 0 else [0] * len(cols) for i in row_map]
+
+
+@functools.lru_cache(maxsize=64)
+def _boundary_indexes(width, height, before, after, boundary_behavior):
+    '''
+    The source row and column of every row and column of a padded image, as
+    used by _padded_rows.  These only depend on the shape, the padding and the
+    boundary behavior, so they are worked out once and reused by every filter
+    applied to images of the same size.  With 'zero', out-of-range columns map
+    to index width (a 0 appended to each row) and out-of-range rows to -1 (a
+    row of zeros).
+    '''
+    if boundary_behavior == 'zero':
+        remap = lambda x, size, outside: x if 0 <= x < size else outside
+        rows = tuple(remap(i, height, -1) for i in range(-before, height+after))
+        cols = tuple(remap(j, width, width) for j in range(-before, width+after))
+        return rows, cols
+    if boundary_behavior == 'wrap':
+        remap = lambda x, size: x % size
+    else:
+        remap = lambda x, size: min(max(x, 0), size-1)
+    rows = tuple(remap(i, height) for i in range(-before, height+after))
+    cols = tuple(remap(j, width) for j in range(-before, width+after))
+    return rows, cols
+
+
+def _integer_factors(kernel):
+    '''
+    If the kernel is made of integers and equals column x row / pivot for
+    integer vectors column and row, return (column, row, pivot); otherwise
+    return None.
+    '''
+    if not all(type(v) is int for r in kernel for v in r):
+        return None
+    pivots = [(a, b) for a in range(len(kernel)) for b in range(len(kernel[a])) if kernel[a][b] != 0]
+    if not pivots:
+        return None
+    r0, b0 = pivots[0]
+    pivot = kernel[r0][b0]
+    row = kernel[r0]
+    column = [kernel[a][b0] for a in range(len(kernel))]
+    for a in range(len(kernel)): # rank one: every 2x2 minor through the pivot vanishes
+        for b in range(len(kernel[a])):
+            if kernel[a][b] * pivot != column[a] * row[b]:
+                return None
+    return column, row, pivot
+
+
+def _separable_correlate(rows, width, column, row, pivot):
+    '''
+    Correlate padded integer rows with the kernel column x row / pivot as a
+    horizontal pass then a vertical pass.  Everything stays an integer, so the
+    result is exact.
+    '''
+    taps = [(b, w) for b, w in enumerate(row) if w != 0]
+    horizontal = []
+    for r in rows:
+        acc = [0] * width
+        for b, w in taps:
+            acc = [s + w*p for s, p in zip(acc, r[b:b+width])]
+        horizontal.append(acc)
+    pixels = []
+    for i in range(len(rows) - len(column) + 1):
+        acc = [0] * width
+        for a, w in enumerate(column):
+            if w != 0:
+                acc = [s + w*p for s, p in zip(acc, horizontal[i+a])]
+        pixels.extend([s // pivot for s in acc])
+    return pixels
 
 
 def getpixel_1(image,i,j,boundary_behavior):
@@ -111,6 +238,7 @@ def getpixel_1(image,i,j,boundary_behavior):
 
 
 
+@_profiled
 def round_and_clip_image(image):
     """
     Given a dictionary, ensure that the values in the 'pixels' list are all
@@ -121,7 +249,12 @@ def round_and_clip_image(image):
     Any locations with values higher than 255 in the input should have value
     255 in the output; and any locations with values lower than 0 in the input
     should have value 0 in the output.
+
+    The pixels of a CompactImage are replaced by a new bytearray.
     """
+    if isinstance(image, CompactImage):
+        image['pixels'] = bytearray(_round_clip(image['pixels']))
+        return
     for i in range(len(image['pixels'])):
         image['pixels'][i]=round(image['pixels'][i])
         if(image['pixels'][i]>255):
@@ -138,12 +271,143 @@ def basicblur(image,n):
     Blurs an image by creating appropraite kernel given n and then applying correlate with said kernel.
     DOES NOT ROUND-AND_CLIP
     '''
-    kernel = nkernel(n)
+    if n % 2 == 1 and all(type(p) is int for p in image['pixels']):
+        return _box_blur(image, n)
+
+    kernel = get_kernel('box', n)
 
     newimage = correlate(image, kernel, 'extend')
 
     return newimage
 
+
+@functools.partial(_profiled, name='box_blur')
+def _box_blur(image, n):
+    '''
+    Same as correlating with nkernel(n) and 'extend', for integer images, using
+    a summed-area table so the cost per pixel does not depend on n.  The box
+    sums are exact integers; for odd n a box average can never be exactly
+    halfway between two integers, so rounding it gives the same pixel as
+    rounding the direct correlation.
+    '''
+    pixels = _sat_box_sums(summed_area_table(image), image, n)
+    weight = 1/(n**2)
+    return _new_image(image, [s * weight for s in pixels], 'd')
+
+
+def _running_sums(values):
+    '''
+    Returns [0, v0, v0+v1, ...] for the given values, so the sum of values
+    a through b-1 is sums[b] - sums[a].
+    '''
+    total = 0
+    sums = [0]
+    for v in values:
+        total += v
+        sums.append(total)
+    return sums
+
+
+def summed_area_table(image):
+    '''
+    Returns the summed-area table (integral image) of an image as a list of
+    height+1 rows of width+1 values: entry [i][j] is the sum of all pixels above
+    and to the left of (i, j), so any rectangle sum takes four lookups.
+    '''
+    width = image['width']
+    pixels = image['pixels']
+    table = [[0] * (width+1)]
+    for i in range(image['height']):
+        above = table[-1]
+        table.append([a + b for a, b in zip(_running_sums(pixels[i*width:(i+1)*width]), above)])
+    return table
+
+
+def _sat_box_sums(table, image, n):
+    '''
+    Sums of the n x n boxes ('extend') around every pixel (odd n), from the
+    summed-area table of the image.  Out-of-range rows and columns repeat the
+    edge ones, so a box is the in-range rectangle, plus the in-range part of
+    the top/bottom row and left/right column counted once per position the box
+    overhangs that edge, plus the corner pixels for boxes overhanging two edges.
+    '''
+    height = image['height']
+    width = image['width']
+    pixels = image['pixels']
+    k = n // 2
+    first, last, left, right, edge_columns = _box_columns(width, k)
+
+    def rect(top, bottom, j): # sum of rows top to bottom-1 within box column range j
+        return table[bottom][last[j]] - table[top][last[j]] - table[bottom][first[j]] + table[top][first[j]]
+
+    def column(c, top, bottom): # sum of column c over rows top to bottom-1
+        return table[bottom][c+1] - table[top][c+1] - table[bottom][c] + table[top][c]
+
+    sums = []
+    for i in range(height):
+        top, bottom = max(0, i-k), min(height, i+k+1)
+        above, below = max(0, k-i), max(0, i+k-(height-1)) # overhang past the top/bottom edge
+        t, b = table[top], table[bottom]
+        row = [b[c] - t[c] - b[a] + t[a] for a, c in zip(first, last)]
+        if above or below:
+            row = [s + above * rect(0, 1, j) + below * rect(height-1, height, j) for j, s in enumerate(row)]
+        for j in edge_columns:
+            row[j] += left[j] * column(0, top, bottom) + right[j] * column(width-1, top, bottom)
+            if above:
+                row[j] += above * (left[j] * pixels[0] + right[j] * pixels[width-1])
+            if below:
+                row[j] += below * (left[j] * pixels[(height-1)*width] + right[j] * pixels[height*width-1])
+        sums.extend(row)
+    return sums
+
+
+@functools.lru_cache(maxsize=64)
+def _box_columns(width, k):
+    '''
+    Column bounds of the boxes of radius k in an image of the given width, for
+    _sat_box_sums: the in-range columns of each box (first to last-1), how far
+    it overhangs the left and right edges, and which boxes overhang at all.
+    '''
+    first = tuple(max(0, j-k) for j in range(width))
+    last = tuple(min(width, j+k+1) for j in range(width))
+    left = tuple(max(0, k-j) for j in range(width))
+    right = tuple(max(0, j+k-(width-1)) for j in range(width))
+    edge_columns = tuple(j for j in range(width) if left[j] or right[j])
+    return first, last, left, right, edge_columns
+
+
+@functools.partial(_profiled, name='box_blur')
+def _box_blur_planes(image, planes, n):
+    '''
+    _box_blur for several pixel lists the size of image (like the channels of
+    a color image) at once: their padded rows are laid side by side, so every
+    pass over the rows handles all of them.  Returns the list of blurred pixel
+    lists.
+    '''
+    height = image['height']
+    width = image['width']
+    k = n // 2
+    weight = 1/(n**2)
+    padded = [_padded_rows({'height': height, 'width': width, 'pixels': p}, k, k, 'extend') for p in planes]
+    stride = width + 2*k # length of each plane's part of a combined row
+    horizontal = []
+    for parts in zip(*padded):
+        prefix = _running_sums([v for part in parts for v in part])
+        sums = [b - a for a, b in zip(prefix, prefix[n:])]
+        row = []
+        for c in range(len(planes)): # keep the windows that lie inside one plane
+            row.extend(sums[c*stride:c*stride+width])
+        horizontal.append(row)
+    window = [sum(column) for column in zip(*horizontal[:n])]
+    out = [[] for _ in planes]
+    for i in range(height):
+        if i:
+            window = [s + new - old for s, new, old in zip(window, horizontal[i+n-1], horizontal[i-1])]
+        for c in range(len(planes)):
+            out[c].extend([s * weight for s in window[c*width:(c+1)*width]])
+    return out
+
+
 def blurred(image, n):
     """
     Identical to basicblur, but also round and clips.
@@ -158,13 +422,29 @@ def blurred(image, n):
 def nkernel(n):
     '''
     creates a square nxn kernel where each element equals 1/n^2
+    (a new list of lists each time, so callers may change it)
     '''
-    copy=[]
-    for i in range(n):
-        copy.append([])
-        for j in range(n):
-            copy[i].append(1/(n**2))
-    return copy
+    return [list(row) for row in get_kernel('box', n)]
+
+
+@functools.lru_cache(maxsize=64)
+def get_kernel(kind, n=3):
+    '''
+    Returns one of the kernels the filters use, built once per (kind, n) and
+    then shared, so it is a read-only tuple of row tuples.  kind is 'box' (the
+    n x n blur kernel), 'sharpen' (2 * identity minus the box kernel), or
+    'sobel_x'/'sobel_y' (the two 3x3 kernels of edges; n is ignored).
+    '''
+    if kind == 'box':
+        return tuple(tuple(1/(n**2) for j in range(n)) for i in range(n))
+    if kind == 'sharpen':
+        box = get_kernel('box', n)
+        return tuple(tuple(2 - v if (i, j) == (n//2, n//2) else -v for j, v in enumerate(row)) for i, row in enumerate(box))
+    if kind == 'sobel_x':
+        return ((-1, 0, 1), (-2, 0, 2), (-1, 0, 1))
+    if kind == 'sobel_y':
+        return ((-1, -2, -1), (0, 0, 0), (1, 2, 1))
+    raise ValueError('unknown kernel %r' % (kind,))
 
 def sharpened(image,n):
     '''
@@ -174,7 +454,7 @@ def sharpened(image,n):
     copy=[]
     for i in range(len(image['pixels'])):
         copy.append(2*image['pixels'][i]-blur['pixels'][i])
-    d={'height':image['height'],'width':image['width'],'pixels':copy}
+    d=_new_image(image, copy, 'd')
     round_and_clip_image(d)
     return d
 
@@ -184,14 +464,14 @@ def edges(image):
     Applies two separate kernels to image one at a time
     Then takes total geometric length of two pixels together to determine edges.
     '''
-    kernel1 = [[-1,0,1],[-2,0,2],[-1,0,1]]
-    kernel2 = [[-1, -2, -1], [0, 0, 0], [1, 2, 1]]
+    kernel1 = get_kernel('sobel_x')
+    kernel2 = get_kernel('sobel_y')
     o1=correlate(image, kernel1, 'extend')
     o2 = correlate(image, kernel2, 'extend')
     copy=[]
     for i in range(len(image['pixels'])):
         copy.append(math.sqrt((o1['pixels'][i])**2+(o2['pixels'][i])**2)) #Takes square root of sum of squares of corresponding pixels
-    d={'height':image['height'],'width':image['width'],'pixels':copy}
+    d=_new_image(image, copy, 'd')
     round_and_clip_image(d)
     return d
 
@@ -199,33 +479,67 @@ def edges(image):
 
 # COLOR FILTERS
 
-def color_filter_from_greyscale_filter(filt):
+def color_filter_from_greyscale_filter(filt, map_channels=map):
     '''
     Given a greyscale filter, creates a filter that takes a color image and applies the grey-scale filter to each color
     Then recombines all three colors together to that filter has been applied to color image to get another color image.
+
+    The channels are split out through one flat buffer of bytes and zipped
+    back together at the end.  Blurs and sharpens (from make_blur_filter and
+    make_sharpen_filter) run on all three channels in a single traversal;
+    other filters run once per channel, through map_channels(filt, channel
+    images) (lab1_tools.map_in_workers runs them in worker processes).
     '''
+    kind, arg = getattr(filt, 'cascade_step', (None, None))
 
     def colorfilt(image):
-        copy1=[]
-        copy2=[]
-        copy3=[]
-        for i in range(len(image['pixels'])):
-            copy1.append(image['pixels'][i][0])
-            copy2.append(image['pixels'][i][1])
-            copy3.append(image['pixels'][i][2])
-        d1={'height':image['height'],'width':image['width'],'pixels':copy1}
-        d2 = {'height': image['height'], 'width': image['width'], 'pixels': copy2}
-        d3 = {'height': image['height'], 'width': image['width'], 'pixels': copy3}
-        newd1=filt(d1)
-        newd2 = filt(d2)
-        newd3 = filt(d3)
-        colorp = []
-        for i in range((len(image['pixels']))):
-            tu=(newd1['pixels'][i],newd2['pixels'][i],newd3['pixels'][i])
-            colorp.append(tu)
-        newcolorimage = {'height': image['height'], 'width': image['width'], 'pixels': colorp}
+        height = image['height']
+        width = image['width']
+        planes = _split_channels(image['pixels'])
+        if kind in ('blur', 'sharpen') and arg % 2 == 1 and all(_is_int_plane(p) for p in planes):
+            blurs = _box_blur_planes(image, planes, arg)
+            if kind == 'blur':
+                channels = [_round_clip(b) for b in blurs]
+            else:
+                channels = [_round_clip(2*p - b for p, b in zip(plane, blur)) for plane, blur in zip(planes, blurs)]
+        else:
+            images = [{'height': height, 'width': width, 'pixels': list(p)} for p in planes]
+            channels = [d['pixels'] for d in map_channels(filt, images)]
+        newcolorimage = {'height': height, 'width': width, 'pixels': list(zip(*channels))}
         return newcolorimage
-    return colorfilt
+    colorfilt.cascade_step = ('color', filt)
+    return _profiled(colorfilt, 'color(%s)' % _filter_name(filt))
+
+
+def _split_channels(pixels):
+    '''
+    Split a list of (r, g, b) pixels into three channels.  When every value is
+    an integer 0-255 the channels come out as bytes, sliced from one flat
+    buffer; otherwise they are lists.
+    '''
+    if not pixels:
+        return [[], [], []]
+    try:
+        flat = bytes([v for pixel in pixels for v in pixel])
+    except (TypeError, ValueError):
+        flat = None
+    if flat is not None and len(flat) == 3*len(pixels):
+        return [flat[c::3] for c in range(3)]
+    return [list(c) for c in zip(*pixels)]
+
+
+def _is_int_plane(pixels):
+    '''
+    Check whether a channel holds only integers.
+    '''
+    return isinstance(pixels, (bytes, bytearray)) or all(type(p) is int for p in pixels)
+
+
+def _round_clip(values):
+    '''
+    Returns a list of values rounded and clipped like round_and_clip_image does.
+    '''
+    return [0 if r < 0 else 255 if r > 255 else r for r in map(round, values)]
 
 
 def make_blur_filter(n):
@@ -235,6 +549,7 @@ def make_blur_filter(n):
     '''
     def blur_filter(image):
         return blurred(image,n)
+    blur_filter.cascade_step = ('blur', n)
     return blur_filter
 
 
@@ -244,21 +559,189 @@ def make_sharpen_filter(n):
     '''
     def sharpen_filter(image):
         return sharpened(image,n)
+    sharpen_filter.cascade_step = ('sharpen', n)
     return sharpen_filter
 
 
-def filter_cascade(filters):
+def filter_cascade(filters, merge_linear=False):
     """
     Given a list of filters (implemented as functions on images), returns a new
     single filter such that applying that filter to an image produces the same
     output as applying each of the individual ones in turn.
+
+    The list is first compiled into a shorter plan (see _compile_cascade) using
+    what the filters made in this file say about themselves: runs of per-pixel
+    filters (inverted, threshold) become one lookup table, applied in the same
+    pass as the rounding of a blur or sharpen before them, and runs of color
+    filters share one split into channels.  All of that gives exactly the same
+    output.
+
+    merge_linear=True trades exactness for speed: adjacent blurs and sharpens
+    are merged into a single kernel, which skips the rounding and clipping in
+    between and extends the original edge pixels instead of the intermediate
+    image's.  Pixels within the merged kernels' combined radius of the border
+    can change substantially (by tens of levels, even for blur(3) twice), and
+    so can any pixel when a sharpen, whose output would have been clipped, is
+    followed by another blur or sharpen.  Elsewhere pixels differ by at most
+    one.  Only use it where that error is acceptable.
     """
+    stages = _compile_cascade(filters, merge_linear)
     def totalcascade(image):
-        d={'height':image['height'],'width':image['width'],'pixels':image['pixels']}
-        for i in range(len(filters)):
-            d=filters[i](d)
+        d=_new_image(image, image['pixels'])
+        for stage in stages:
+            d=stage(d)
         return d
+    totalcascade.cascade_step = ('cascade', list(filters))
     return totalcascade
+
+
+def _cascade_steps(filters):
+    '''
+    Flatten nested cascades into a list of (kind, argument, filter) steps, kind
+    being 'pixel', 'blur', 'sharpen', 'color', or None for filters that cannot
+    be fused with anything.
+    '''
+    steps = []
+    for filt in filters:
+        kind, arg = getattr(filt, 'cascade_step', (None, None))
+        if kind == 'cascade':
+            steps.extend(_cascade_steps(arg))
+        else:
+            steps.append((kind, arg, filt))
+    return steps
+
+
+def _compile_cascade(filters, merge_linear):
+    '''
+    Turn a list of filters into a list of stages (functions on images) with the
+    same combined effect, fusing the steps that can be fused.
+    '''
+    plan = [] # entries are [kind, data, per-pixel functions applied afterwards]
+    for kind, arg, filt in _cascade_steps(filters):
+        last = plan[-1] if plan else None
+        if kind == 'pixel' and last is not None and last[0] in ('pixel', 'linear'):
+            last[2].append(arg)
+        elif kind == 'pixel':
+            plan.append(['pixel', None, [arg]])
+        elif kind in ('blur', 'sharpen'):
+            if (merge_linear and last is not None and last[0] == 'linear' and not last[2]
+                    and arg % 2 == 1 and len(_linear_kernel(last[1])) % 2 == 1):
+                last[1] = ('kernel', _compose_kernels(_linear_kernel(last[1]), _linear_kernel((kind, arg))))
+            else:
+                plan.append(['linear', (kind, arg), []])
+        elif kind == 'color' and last is not None and last[0] == 'color':
+            last[1].append(arg)
+        elif kind == 'color':
+            plan.append(['color', [arg], []])
+        else:
+            plan.append([None, filt, []])
+    stages = []
+    for index, (kind, data, funcs) in enumerate(plan):
+        if kind == 'pixel':
+            stage, name = _pixel_stage(funcs), 'lookup table'
+        elif kind == 'linear':
+            stage = _linear_stage(data, funcs)
+            name = '%s(%s)' % data if data[0] != 'kernel' else 'kernel(%dx%d)' % (len(data[1]), len(data[1]))
+        elif kind == 'color':
+            stage = color_filter_from_greyscale_filter(filter_cascade(data, merge_linear))
+            name = 'color(%s)' % ', '.join(_filter_name(f) for f in data)
+        else:
+            stage, name = data, _filter_name(data)
+        if funcs and kind != 'pixel':
+            name += ' + lookup table'
+        stages.append(_profiled(stage, 'cascade[%d] %s' % (index, name)))
+    return stages
+
+
+def _filter_name(filt):
+    '''
+    A short description of a filter for profiling reports, e.g. 'blur(5)'.
+    '''
+    kind, arg = getattr(filt, 'cascade_step', (None, None))
+    if kind in ('blur', 'sharpen'):
+        return '%s(%d)' % (kind, arg)
+    if kind == 'color':
+        return 'color(%s)' % _filter_name(arg)
+    if kind == 'cascade':
+        return 'cascade(%s)' % ', '.join(_filter_name(f) for f in arg)
+    return getattr(filt, '__name__', 'filter')
+
+
+def _lookup_table(funcs):
+    '''
+    Returns the results of applying funcs in turn to each of the values 0-255.
+    '''
+    table = list(range(256))
+    for func in funcs:
+        table = [func(c) for c in table]
+    return table
+
+
+def _pixel_stage(funcs):
+    '''
+    A filter applying the per-pixel functions funcs in turn, as one lookup
+    per pixel when the image only holds integers 0-255.
+    '''
+    table = _lookup_table(funcs)
+    def stage(image):
+        pixels = image['pixels']
+        if all(type(p) is int for p in pixels) and (not pixels or 0 <= min(pixels) and max(pixels) <= 255):
+            out = [table[p] for p in pixels]
+        else:
+            out = list(pixels)
+            for func in funcs:
+                out = [func(c) for c in out]
+        return _new_image(image, out)
+    return stage
+
+
+def _linear_stage(spec, funcs):
+    '''
+    A filter for a blur, sharpen or merged kernel (spec) followed by rounding
+    and clipping and then the per-pixel functions funcs, done in one pass.
+    '''
+    table = _lookup_table(funcs)
+    kind, arg = spec
+    def stage(image):
+        if kind == 'blur':
+            values = basicblur(image, arg)['pixels']
+        elif kind == 'sharpen':
+            values = (2*p - b for p, b in zip(image['pixels'], basicblur(image, arg)['pixels']))
+        else:
+            values = correlate(image, arg, 'extend')['pixels']
+        out = [table[r] for r in _round_clip(values)]
+        return _new_image(image, out)
+    return stage
+
+
+def _linear_kernel(spec):
+    '''
+    The kernel applied by a blur, sharpen or merged kernel spec.
+    '''
+    kind, arg = spec
+    if kind == 'kernel':
+        return arg
+    if kind == 'sharpen': # 2 * image - blurred image
+        return get_kernel('sharpen', arg)
+    return get_kernel('box', arg)
+
+
+def _compose_kernels(first, second):
+    '''
+    Returns the (odd-sized) kernel that correlating with first and then with
+    second amounts to.
+    '''
+    n1 = len(first)
+    n2 = len(second)
+    kernel = [[0] * (n1+n2-1) for _ in range(n1+n2-1)]
+    for a in range(n1):
+        for b in range(n1):
+            for c in range(n2):
+                for d in range(n2):
+                    kernel[a+c][b+d] += first[a][b] * second[c][d]
+    return kernel
+
+
 def threshold(n):
     '''
     Creates a function that takes in n between 0 and 255
@@ -267,6 +750,8 @@ def threshold(n):
     Thus, all pixels are either 255 or 0
     '''
     def threshold_filter(image):
+        if isinstance(image, CompactImage):
+            return _new_image(image, bytearray(255 if p > n else 0 for p in image['pixels']))
         a=image['pixels'][:]
         d = {'height': image['height'], 'width': image['width'], 'pixels': a}
         for i in range(len(image['pixels'])):
@@ -275,20 +760,76 @@ def threshold(n):
             else:
                 d['pixels'][i]=0
         return d
+    threshold_filter.cascade_step = ('pixel', lambda c: 255 if c > n else 0)
     return threshold_filter
 
+# COMPACT IMAGES
+
+class CompactImage(dict):
+    '''
+    A greyscale image dictionary ('height', 'width', 'pixels') whose pixels are
+    a bytearray (typecode 'B', for images of integers 0-255, one byte per
+    pixel) or an array of 8-byte floats (typecode 'd', for in-between results
+    like the output of correlate) instead of a list.
+
+    get_pixel, set_pixel and all of the greyscale filters accept it, and the
+    filters return compact images when given one: correlate returns 'd'
+    pixels, and round_and_clip_image turns them back into bytes.  Those hold
+    exactly the floats a list would, so every filter rounds to the same pixels
+    as on the list image.  With typecode None, 'B' is used if every pixel fits
+    in a byte.
+    '''
+
+    def __init__(self, image, typecode=None):
+        super().__init__(height=image['height'], width=image['width'],
+                         pixels=_compact_pixels(image['pixels'], typecode))
+
+
+def _compact_pixels(pixels, typecode):
+    '''
+    Convert a sequence of pixels to the storage for the given typecode (see
+    CompactImage), without copying if it is already stored that way.
+    '''
+    if typecode is None:
+        try:
+            return pixels if isinstance(pixels, bytearray) else bytearray(pixels)
+        except (TypeError, ValueError):
+            typecode = 'd'
+    if typecode == 'B':
+        return pixels if isinstance(pixels, bytearray) else bytearray(pixels)
+    if typecode == 'd':
+        return pixels if isinstance(pixels, array) and pixels.typecode == 'd' else array('d', pixels)
+    raise ValueError('unsupported typecode: %r' % typecode)
+
+
+def _new_image(like, pixels, typecode=None):
+    '''
+    Returns a new image of the same size as like with the given pixels, which
+    is a CompactImage (stored as typecode) if like is one.
+    '''
+    image = {'height': like['height'], 'width': like['width'], 'pixels': pixels}
+    if isinstance(like, CompactImage):
+        return CompactImage(image, typecode)
+    return image
+
+
 # HELPER FUNCTIONS FOR LOADING AND SAVING IMAGES
 
-def load_greyscale_image(filename):
+def load_greyscale_image(filename, compact=False):
     """
     Loads an image from the given file and returns an instance of this class
     representing that image.  This also performs conversion to greyscale.
 
+    If compact is True, returns a CompactImage built straight from the image's
+    raw bytes, without making a Python object per pixel.
+
     Invoked as, for example:
        i = load_greyscale_image('test_images/cat.png')
     """
     with open(filename, 'rb') as img_handle:
         img = Image.open(img_handle)
+        if compact:
+            return _load_compact_greyscale(img)
         img_data = img.getdata()
         if img.mode.startswith('RGB'):
             pixels = [round(.299 * p[0] + .587 * p[1] + .114 * p[2])
@@ -310,8 +851,11 @@ def save_greyscale_image(image, filename, mode='PNG'):
     filename is given as a file-like object, the file type will be determined
     by the 'mode' parameter.
     """
-    out = Image.new(mode='L', size=(image['width'], image['height']))
-    out.putdata(image['pixels'])
+    if isinstance(image['pixels'], (bytes, bytearray)):
+        out = Image.frombuffer('L', (image['width'], image['height']), bytes(image['pixels']), 'raw', 'L', 0, 1)
+    else:
+        out = Image.new(mode='L', size=(image['width'], image['height']))
+        out.putdata(image['pixels'])
     if isinstance(filename, str):
         out.save(filename)
     else:
@@ -319,6 +863,29 @@ def save_greyscale_image(image, filename, mode='PNG'):
     out.close()
 
 
+def _load_compact_greyscale(img):
+    """
+    Build a CompactImage from an open PIL image, converting to greyscale the
+    same way load_greyscale_image does.
+    """
+    w, h = img.size
+    if img.mode == 'L':
+        pixels = bytearray(img.tobytes())
+    elif img.mode == 'LA':
+        pixels = bytearray(img.tobytes()[0::2])
+    elif img.mode.startswith('RGB'):
+        data = img.tobytes()
+        step = len(img.mode) # 3 for RGB, 4 for RGBA/RGBX
+        red = [.299 * v for v in range(256)] # same products as the formula, so the same rounding
+        green = [.587 * v for v in range(256)]
+        blue = [.114 * v for v in range(256)]
+        pixels = bytearray(round(red[r] + green[g] + blue[b])
+                           for r, g, b in zip(data[0::step], data[1::step], data[2::step]))
+    else:
+        raise ValueError('Unsupported image mode: %r' % img.mode)
+    return CompactImage({'height': h, 'width': w, 'pixels': pixels}, 'B')
+
+
 def load_color_image(filename):
     """
     Loads a color image from the given file and returns a dictionary
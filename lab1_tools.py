@@ -0,0 +1,740 @@
+#!/usr/bin/env python3
+'''
+Tools built on the lab 1 filters: stage profiling and benchmarks, filtering
+in worker processes (by color channel or by bands of rows), streaming filters
+for images too big for memory, video frame pipelines, and the command line.
+Run with --help for usage.
+'''
+
+import os
+import sys
+import json
+import math
+import time
+import queue
+import threading
+import argparse
+import tracemalloc
+import collections
+import multiprocessing
+import concurrent.futures
+
+import lab1
+from lab1 import (inverted, correlate, edges, threshold, make_blur_filter, make_sharpen_filter,
+                  color_filter_from_greyscale_filter, filter_cascade, get_kernel,
+                  load_greyscale_image, save_greyscale_image, load_color_image, save_color_image,
+                  _new_image, _round_clip, _running_sums)
+
+
+# PROFILING
+
+# While profiling is on (see start_profiling), _profile maps each stage name to
+# its totals: calls, seconds, pixels and bytes (the most memory any one call
+# allocated on top of what was in use when it started, if memory is being
+# traced).
+_profile = None
+_peaks = [] # peak memory seen so far by each profiled call in progress
+_started_tracing = False # whether start_profiling started tracemalloc
+
+
+def start_profiling(memory=False):
+    '''
+    Start recording time (and, with memory=True, memory allocated through
+    tracemalloc, which slows everything down noticeably) for correlate,
+    round_and_clip_image, the box blur, color filters and each stage of filter
+    cascades.  Work done in worker processes is not recorded.
+    '''
+    global _profile, _started_tracing
+    _profile = {}
+    lab1._profiler = _record
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _started_tracing = True
+
+
+def stop_profiling():
+    '''
+    Stop profiling and return the totals recorded since start_profiling, as a
+    dictionary mapping stage names to dictionaries with keys 'calls',
+    'seconds', 'pixels', 'pixels_per_second' and 'bytes'.
+    '''
+    global _profile, _started_tracing
+    lab1._profiler = None
+    stats, _profile = _profile or {}, None
+    if _started_tracing:
+        tracemalloc.stop()
+        _started_tracing = False
+    for totals in stats.values():
+        totals['pixels_per_second'] = totals['pixels'] / max(totals['seconds'], 1e-9)
+    return stats
+
+
+def _record(name, func, image, args, kwargs):
+    '''
+    Call func(image, *args, **kwargs) for a stage wrapped by lab1._profiled,
+    adding its time (and memory) to the totals of the stage called name.
+    '''
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        current, peak = tracemalloc.get_traced_memory()
+        if _peaks:
+            _peaks[-1] = max(_peaks[-1], peak) # resetting the peak below must not lose the caller's
+        _peaks.append(current)
+        tracemalloc.reset_peak()
+    start = time.perf_counter()
+    try:
+        return func(image, *args, **kwargs)
+    finally:
+        seconds = time.perf_counter() - start
+        allocated = 0
+        if tracing:
+            peak = max(_peaks.pop(), tracemalloc.get_traced_memory()[1])
+            allocated = peak - current
+            if _peaks:
+                _peaks[-1] = max(_peaks[-1], peak)
+        if _profile is not None:
+            totals = _profile.setdefault(name, {'calls': 0, 'seconds': 0.0, 'pixels': 0, 'bytes': 0})
+            totals['calls'] += 1
+            totals['seconds'] += seconds
+            totals['pixels'] += image['height'] * image['width']
+            totals['bytes'] = max(totals['bytes'], allocated)
+
+
+def profile_report(stats):
+    '''
+    Format profiling totals (as returned by stop_profiling) as a table, the
+    slowest stage first.
+    '''
+    lines = ['%-48s %7s %10s %14s %12s' % ('stage', 'calls', 'seconds', 'pixels/s', 'bytes')]
+    for name, t in sorted(stats.items(), key=lambda item: -item[1]['seconds']):
+        lines.append('%-48s %7d %10.4f %14.0f %12d' % (name, t['calls'], t['seconds'], t['pixels_per_second'], t['bytes']))
+    return '\n'.join(lines)
+
+
+# WORKER PROCESSES
+
+def map_in_workers(func, items, workers=None):
+    '''
+    Returns [func(item) for item in items], computed in up to workers worker
+    processes.  The workers are forked from this process, so func does not have
+    to be picklable (closures like the filters made in lab1 work); where
+    fork is not available, or workers is None or 1, everything runs here.
+
+    With workers given (say through functools.partial), this can be the
+    map_channels of lab1.color_filter_from_greyscale_filter.
+    '''
+    if not workers or workers <= 1 or len(items) <= 1 or 'fork' not in multiprocessing.get_all_start_methods():
+        return [func(item) for item in items]
+    context = multiprocessing.get_context('fork')
+    with concurrent.futures.ProcessPoolExecutor(min(workers, len(items)), mp_context=context,
+                                                initializer=_set_worker_function, initargs=(func,)) as pool:
+        return list(pool.map(_call_worker_function, items))
+
+
+_worker_function = None
+
+
+def _set_worker_function(func):
+    global _worker_function
+    _worker_function = func
+
+
+def _call_worker_function(item):
+    return _worker_function(item)
+
+
+# TILED FILTERING
+
+def tiled_filter(filt, radius=None, boundary_behavior='extend', workers=None, band_height=None):
+    '''
+    Creates a filter that gives the same output as filt, but splits the image
+    into bands of rows, filters the bands in worker processes and stitches the
+    results back together.
+
+    Each band is sent with radius extra rows above and below it (its halo), so
+    the rows kept from it see exactly the neighbours they would in the whole
+    image; boundary_behavior is the one filt uses ('wrap' takes the halo rows of
+    the top and bottom bands from the other end of the image).  radius can be
+    left out for the blurs, sharpens, edges and per-pixel filters made in
+    lab1.  workers defaults to the number of cores.
+    '''
+    if radius is None:
+        radius = _filter_radius(filt)
+    workers = workers or os.cpu_count() or 1
+
+    def run_band(band):
+        image, top, rows = band
+        result = filt(image)
+        return result['pixels'][top*image['width']:(top+rows)*image['width']]
+
+    def tiledfilt(image):
+        height = image['height']
+        width = image['width']
+        size = band_height or max(1, -(-height // (2*workers)))
+        bands = [_band(image, start, min(size, height-start), radius, boundary_behavior)
+                 for start in range(0, height, size)]
+        pixels = []
+        for part in map_in_workers(run_band, bands, workers):
+            pixels.extend(part)
+        return _new_image(image, pixels)
+    return tiledfilt
+
+
+def tiled_correlate(image, kernel, boundary_behavior, workers=None, band_height=None):
+    '''
+    correlate(image, kernel, boundary_behavior), computed in row bands by worker
+    processes (see tiled_filter).
+    '''
+    if boundary_behavior not in ('zero', 'extend', 'wrap'):
+        return None
+    run = tiled_filter(lambda band: correlate(band, kernel, boundary_behavior),
+                       len(kernel)//2, boundary_behavior, workers, band_height)
+    return run(image)
+
+
+def _filter_radius(filt):
+    '''
+    How many rows away from a pixel the filters made in lab1 look.
+    '''
+    if filt is edges:
+        return 1
+    kind, arg = getattr(filt, 'cascade_step', (None, None))
+    if kind in ('blur', 'sharpen'):
+        return arg // 2
+    if kind == 'pixel':
+        return 0
+    raise ValueError('cannot tell how far %r looks; give a radius' % (filt,))
+
+
+def _band(image, start, rows, radius, boundary_behavior):
+    '''
+    Returns (band image, index of its first own row, number of own rows) for
+    rows start to start+rows of the image plus a halo of radius rows.
+    '''
+    height = image['height']
+    width = image['width']
+    pixels = image['pixels']
+    if boundary_behavior == 'wrap':
+        first, last = start - radius, start + rows + radius
+    else: # the image's own edge is where the band's boundary behavior applies
+        first, last = max(0, start - radius), min(height, start + rows + radius)
+    if 0 <= first and last <= height:
+        band = pixels[first*width:last*width]
+    else:
+        band = []
+        for i in range(first, last):
+            i %= height
+            band.extend(pixels[i*width:(i+1)*width])
+    return {'height': last - first, 'width': width, 'pixels': band}, start - first, rows
+
+
+# STREAMING FILTERS
+#
+# For images too big to hold in memory: rows are read from a binary PGM file
+# one at a time, pass through a chain of stages that each keep only the few
+# rows their kernel needs, and are written out as soon as they are done.
+# Every stage gives exactly the same pixels as the whole-image filter.
+
+def stream_filter(infile, outfile, stages):
+    '''
+    Run the rows of the greyscale PGM image infile through the given stages
+    (made by stream_blurred, stream_sharpened, stream_edges, stream_threshold
+    or stream_inverted) and write the result to the PGM file outfile.  Peak
+    memory depends on the width of the image and the kernel sizes, not on the
+    height.
+    '''
+    width, height, rows = read_pgm_rows(infile)
+    for stage in stages:
+        rows = stage(rows, width)
+    write_pgm_rows(outfile, width, height, rows)
+
+
+def read_pgm_rows(filename):
+    '''
+    Opens a binary (P5) PGM file with 8-bit pixels and returns its width, its
+    height and an iterator over its rows (as bytes), read lazily.
+    '''
+    f = open(filename, 'rb')
+    fields = []
+    while len(fields) < 4: # magic number, width, height, maximum value
+        token = b''
+        c = f.read(1)
+        while c.isspace() or c == b'#':
+            if c == b'#':
+                f.readline()
+            c = f.read(1)
+        while c and not c.isspace():
+            token += c
+            c = f.read(1)
+        if not token:
+            raise ValueError('truncated PGM header in %r' % filename)
+        fields.append(token)
+    if fields[0] != b'P5' or int(fields[3]) > 255:
+        raise ValueError('only binary PGM files with 8-bit pixels are supported')
+    width, height = int(fields[1]), int(fields[2])
+
+    def rows():
+        with f:
+            for _ in range(height):
+                row = f.read(width)
+                if len(row) < width:
+                    raise ValueError('truncated PGM data in %r' % filename)
+                yield row
+    return width, height, rows()
+
+
+def write_pgm_rows(filename, width, height, rows):
+    '''
+    Writes rows of integers 0-255 to a binary PGM file, one at a time.
+    '''
+    with open(filename, 'wb') as f:
+        f.write(b'P5\n%d %d\n255\n' % (width, height))
+        for row in rows:
+            f.write(bytes(row))
+
+
+def stream_blurred(n):
+    '''
+    Streaming stage for blurred(image, n).
+    '''
+    if n % 2 == 0:
+        return _kernel_stage(get_kernel('box', n), lambda row, values: _round_clip(values))
+    def stage(rows, width):
+        weight = 1/(n**2)
+        for row, sums in _box_sums(rows, width, n):
+            yield _round_clip([s * weight for s in sums])
+    return stage
+
+
+def stream_sharpened(n):
+    '''
+    Streaming stage for sharpened(image, n).
+    '''
+    if n % 2 == 0:
+        return _kernel_stage(get_kernel('box', n), lambda row, values: _round_clip([2*p - v for p, v in zip(row, values)]))
+    def stage(rows, width):
+        weight = 1/(n**2)
+        for row, sums in _box_sums(rows, width, n):
+            yield _round_clip([2*p - s * weight for p, s in zip(row, sums)])
+    return stage
+
+
+def stream_edges():
+    '''
+    Streaming stage for edges(image).
+    '''
+    def stage(rows, width):
+        kernel1 = get_kernel('sobel_x')
+        kernel2 = get_kernel('sobel_y')
+        for window in _row_windows(rows, width, 1, 1):
+            o1 = _correlate_row(window, kernel1, width)
+            o2 = _correlate_row(window, kernel2, width)
+            yield _round_clip([math.sqrt(a**2 + b**2) for a, b in zip(o1, o2)])
+    return stage
+
+
+def stream_threshold(n):
+    '''
+    Streaming stage for threshold(n).
+    '''
+    def stage(rows, width):
+        for row in rows:
+            yield [255 if p > n else 0 for p in row]
+    return stage
+
+
+def stream_inverted():
+    '''
+    Streaming stage for inverted.
+    '''
+    def stage(rows, width):
+        for row in rows:
+            yield [255-p for p in row]
+    return stage
+
+
+def _extended_rows(rows, before, after):
+    '''
+    Yield the rows with the first one repeated before extra times and the last
+    one after extra times ('extend' past the top and bottom of the image).
+    '''
+    last = None
+    for row in rows:
+        if last is None:
+            for _ in range(before):
+                yield row
+        last = row
+        yield row
+    if last is not None:
+        for _ in range(after):
+            yield last
+
+
+def _row_windows(rows, width, before, after):
+    '''
+    For each row, yield the list of rows from before rows above it to after
+    rows below it ('extend' past the top and bottom), each padded with before
+    copies of its first pixel on the left and after copies of its last pixel
+    on the right.  Only before+after+1 rows are kept at any time.
+    '''
+    window = collections.deque(maxlen=before+1+after)
+    for row in _extended_rows(rows, before, after):
+        window.append([row[0]]*before + list(row) + [row[-1]]*after)
+        if len(window) == window.maxlen:
+            yield list(window)
+
+
+def _correlate_row(window, kernel, width):
+    '''
+    One row of correlate(image, kernel, 'extend') from the padded rows around it
+    (see _row_windows), summed in the same order as correlate.
+    '''
+    acc = [0] * width
+    for a, row in enumerate(window):
+        for b, weight in enumerate(kernel[a]):
+            if weight != 0:
+                acc = [s + weight*p for s, p in zip(acc, row[b:b+width])]
+    return acc
+
+
+def _kernel_stage(kernel, finish):
+    '''
+    A streaming stage correlating with kernel (with 'extend') and passing each
+    original row and its correlated values to finish.
+    '''
+    n = len(kernel)
+    before = int((n-1)/2)
+    def stage(rows, width):
+        for window in _row_windows(rows, width, before, n-1-before):
+            yield finish(window[before][before:before+width], _correlate_row(window, kernel, width))
+    return stage
+
+
+def _box_sums(rows, width, n):
+    '''
+    For each row, yield the row and the exact integer sums of the n x n boxes
+    ('extend') centred on its pixels, for odd n: the horizontal sums of the
+    last n rows are kept in a ring, with a running total of them.
+    '''
+    k = n // 2
+    window = collections.deque() # (row, its horizontal box sums) for the last n rows
+    total = None
+    for row in _extended_rows(rows, k, k):
+        prefix = _running_sums([row[0]]*k + list(row) + [row[-1]]*k)
+        sums = [b - a for a, b in zip(prefix, prefix[n:])]
+        window.append((row, sums))
+        total = sums if total is None else [s + v for s, v in zip(total, sums)]
+        if len(window) > n:
+            total = [s - v for s, v in zip(total, window.popleft()[1])]
+        if len(window) == n:
+            yield window[k][0], total
+
+
+# VIDEO FRAMES
+#
+# The same filter applied to every frame of an image sequence.  Frames are
+# decoded in one thread, filtered in worker processes and encoded in another
+# thread, all at the same time, with bounded queues in between so a fast
+# decoder cannot get far ahead of the filtering.  Frames are written in order.
+
+VIDEO_FILTERS = {
+    'inverted': 'inverted',
+    'blur': 'blur:N  blurred(image, N)',
+    'sharpen': 'sharpen:N  sharpened(image, N)',
+    'edges': 'edges',
+    'threshold': 'threshold:N  threshold(N)',
+}
+
+
+def parse_filters(specs, color=False):
+    '''
+    Turn filter specifications like 'blur:5', 'edges' or 'threshold:128' (see
+    VIDEO_FILTERS) into one filter_cascade, made of color filters if color.
+    '''
+    filters = []
+    for spec in specs:
+        name, *args = spec.split(':')
+        if name in ('inverted', 'edges') and not args:
+            filt = inverted if name == 'inverted' else edges
+        elif name in ('blur', 'sharpen', 'threshold') and len(args) == 1 and args[0].isdigit():
+            make = {'blur': make_blur_filter, 'sharpen': make_sharpen_filter, 'threshold': threshold}[name]
+            filt = make(int(args[0]))
+        else:
+            raise ValueError('bad filter %r, expected one of: %s' % (spec, '; '.join(VIDEO_FILTERS.values())))
+        filters.append(color_filter_from_greyscale_filter(filt) if color else filt)
+    return filter_cascade(filters)
+
+
+def png_frames(directory, color=True):
+    '''
+    Yields the images in the PNG files of directory, in order of file name.
+    '''
+    load = load_color_image if color else load_greyscale_image
+    for name in sorted(os.listdir(directory)):
+        if name.lower().endswith('.png'):
+            yield load(os.path.join(directory, name))
+
+
+def raw_frames(stream, width, height, color=True):
+    '''
+    Yields the frames of a raw video stream (a binary file object): frames of
+    width x height 8-bit greyscale or 24-bit RGB pixels one after another, as
+    read and written by e.g. ffmpeg -f rawvideo -pix_fmt gray (or rgb24).
+    '''
+    size = width * height * (3 if color else 1)
+    while True:
+        data = stream.read(size)
+        if not data:
+            return
+        if len(data) < size:
+            raise ValueError('truncated frame: %d of %d bytes' % (len(data), size))
+        if color:
+            pixels = list(zip(data[0::3], data[1::3], data[2::3]))
+        else:
+            pixels = list(data)
+        yield {'height': height, 'width': width, 'pixels': pixels}
+
+
+def png_writer(directory, color=True, pattern='frame%06d.png'):
+    '''
+    Returns a function write(index, image) saving frames as PNG files named
+    after pattern in directory.
+    '''
+    os.makedirs(directory, exist_ok=True)
+    save = save_color_image if color else save_greyscale_image
+    def write(index, image):
+        save(image, os.path.join(directory, pattern % index))
+    return write
+
+
+def raw_writer(stream, color=True):
+    '''
+    Returns a function write(index, image) appending frames to a raw video
+    stream (see raw_frames).
+    '''
+    def write(index, image):
+        pixels = image['pixels']
+        if color:
+            stream.write(bytes([v for pixel in pixels for v in pixel]))
+        else:
+            stream.write(bytes(pixels))
+    return write
+
+
+def process_frames(frames, filt, write, workers=None, queue_size=8, report=None):
+    '''
+    Apply filt to every image of the iterable frames (e.g. png_frames or
+    raw_frames) and call write(index, result) for each (e.g. a png_writer or
+    raw_writer), in the same order.  Decoding (iterating over frames),
+    filtering and writing overlap: each runs on its own, with at most
+    queue_size frames waiting between decoding and filtering and between
+    filtering and writing.  The filtering is spread over workers worker
+    processes (default: the number of cores), forked so that filt does not
+    have to be picklable; where fork is not available, or with workers=1, it
+    runs in this process.  report, if given, is called with a progress line
+    for each frame written.  Returns a summary dictionary (frames, seconds,
+    frames_per_second, workers).
+    '''
+    workers = workers or os.cpu_count() or 1
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        workers = 1
+    decoded = queue.Queue(queue_size)
+    filtered = queue.Queue(queue_size)
+    done = object() # marks the end of a queue
+    stop = threading.Event() # set when the pipeline fails, to stop decoding
+    errors = []
+    written = [0]
+    start = time.perf_counter()
+
+    def decode():
+        try:
+            for frame in frames:
+                if stop.is_set():
+                    return
+                decoded.put(frame)
+        except BaseException as e:
+            errors.append(e)
+        if not stop.is_set():
+            decoded.put(done)
+
+    def encode():
+        while True:
+            image = filtered.get()
+            if image is done:
+                return
+            if errors:
+                continue # keep emptying the queue so filtering is never stuck
+            try:
+                write(written[0], image)
+            except BaseException as e:
+                errors.append(e)
+                stop.set()
+                continue
+            written[0] += 1
+            if report is not None:
+                seconds = time.perf_counter() - start
+                report('%d frames in %.2fs (%.2f frames/s)' % (written[0], seconds, written[0] / max(seconds, 1e-9)))
+
+    pool = None
+    if workers > 1:
+        context = multiprocessing.get_context('fork')
+        pool = concurrent.futures.ProcessPoolExecutor(workers, mp_context=context,
+                                                      initializer=_set_worker_function, initargs=(filt,))
+        pool.submit(int).result() # fork the workers now, before the threads below start
+    threads = [threading.Thread(target=decode, daemon=True), threading.Thread(target=encode, daemon=True)]
+    for thread in threads:
+        thread.start()
+    pending = collections.deque() # futures of the frames being filtered, in order
+    try:
+        while not errors:
+            frame = decoded.get()
+            if frame is done:
+                break
+            if pool is None:
+                filtered.put(filt(frame))
+                continue
+            pending.append(pool.submit(_call_worker_function, frame))
+            if len(pending) >= 2*workers:
+                filtered.put(pending.popleft().result())
+        while pending and not errors:
+            filtered.put(pending.popleft().result())
+    except BaseException:
+        stop.set()
+        raise
+    finally:
+        if errors:
+            stop.set()
+        if stop.is_set(): # make room for a decoder blocked on a full queue
+            while not decoded.empty():
+                decoded.get_nowait()
+        filtered.put(done)
+        threads[1].join()
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+    if errors:
+        raise errors[0]
+    seconds = time.perf_counter() - start
+    return {'frames': written[0], 'seconds': seconds,
+            'frames_per_second': written[0] / max(seconds, 1e-9), 'workers': workers}
+
+
+# BENCHMARKS: run the standard filters on synthetic images of increasing size
+# with profiling on, to see which stage takes the time
+
+BENCH_SIZES = (64, 128, 256, 512, 1024, 2048, 4096, 8192) # width and height
+
+
+def synthetic_image(size, color=False):
+    '''
+    Make a deterministic size x size test image with smooth gradients, sharp
+    edges and some texture, in greyscale or color.
+    '''
+    def value(i, j, shift):
+        v = (i + j + shift) * 255 // (2*size) # gradient
+        if (i // 16 + j // 16 + shift) % 2: # checkerboard of sharp edges
+            v = 255 - v
+        return (v + (i * 7 + j * 13 + shift) % 23) % 256 # texture
+    pixels = [value(i, j, 0) for i in range(size) for j in range(size)]
+    if color:
+        pixels = list(zip(pixels, [value(i, j, 40) for i in range(size) for j in range(size)],
+                          [value(i, j, 80) for i in range(size) for j in range(size)]))
+    return {'height': size, 'width': size, 'pixels': pixels}
+
+
+def run_benchmarks(sizes=(64, 128, 256), repeat=1, memory=False, report=print):
+    '''
+    Time the standard filters and two cascades on synthetic square images of
+    each of the given sizes, keeping the best of repeat runs.  Returns a list
+    of result dictionaries (name, size, pixels, seconds, and the profiling
+    totals of the best run under 'stages'), calling report with a line for
+    each case followed by its stages.
+    '''
+    cases = [
+        ('inverted', False, inverted),
+        ('blurred(5)', False, make_blur_filter(5)),
+        ('sharpened(5)', False, make_sharpen_filter(5)),
+        ('edges', False, edges),
+        ('threshold(128)', False, threshold(128)),
+        ('cascade', False, filter_cascade([edges, make_blur_filter(3), inverted, threshold(100)])),
+        ('color blurred(5)', True, color_filter_from_greyscale_filter(make_blur_filter(5))),
+        ('color edges', True, color_filter_from_greyscale_filter(edges)),
+        ('color cascade', True, filter_cascade([color_filter_from_greyscale_filter(edges),
+                                                color_filter_from_greyscale_filter(make_sharpen_filter(3)),
+                                                color_filter_from_greyscale_filter(inverted)])),
+    ]
+    results = []
+    for size in sizes:
+        images = {False: synthetic_image(size), True: synthetic_image(size, color=True)}
+        for name, color, filt in cases:
+            best = None
+            for _ in range(repeat):
+                start_profiling(memory)
+                start = time.perf_counter()
+                try:
+                    filt(images[color])
+                finally:
+                    seconds = time.perf_counter() - start
+                    stages = stop_profiling()
+                if best is None or seconds < best[0]:
+                    best = (seconds, stages)
+            seconds, stages = best
+            results.append({'name': name, 'size': size, 'pixels': size*size, 'seconds': seconds, 'stages': stages})
+            report('%-18s %5dx%-5d %9.4fs %12.0f pixels/s' % (name, size, size, seconds, size*size / max(seconds, 1e-9)))
+            for line in profile_report(stages).splitlines()[1:]:
+                report('    ' + line)
+    return results
+
+
+def main(argv=None):
+    '''
+    Command line entry point; run with --help for usage.
+    '''
+    parser = argparse.ArgumentParser(description='6.009 lab 1 image filters')
+    commands = parser.add_subparsers(dest='command', required=True)
+    bench = commands.add_parser('bench', help='time the filters, stage by stage, on synthetic images')
+    bench.add_argument('-s', '--sizes', type=int, nargs='+', default=[64, 128, 256],
+                       help='image widths/heights to try (up to %d; the largest take hours)' % BENCH_SIZES[-1])
+    bench.add_argument('-r', '--repeat', type=int, default=1, help='runs per case (the best is kept)')
+    bench.add_argument('-m', '--memory', action='store_true',
+                       help='also record the memory each stage allocates (slower)')
+    bench.add_argument('-o', '--output', help='JSON file to save the results to')
+    video = commands.add_parser('video', help='apply a filter cascade to every frame of an image sequence',
+                                epilog='filters: ' + '; '.join(VIDEO_FILTERS.values()))
+    video.add_argument('input', help='directory of PNG frames, or a raw video file with --raw')
+    video.add_argument('output', help='directory to write PNG frames to, or a raw video file with --raw')
+    video.add_argument('-f', '--filter', action='append', default=[], dest='filters',
+                       help='filter to apply (repeat for a cascade, applied in order)')
+    video.add_argument('--raw', metavar='WIDTHxHEIGHT', help='read and write raw video frames of this size')
+    video.add_argument('-g', '--greyscale', action='store_true', help='treat the frames as greyscale')
+    video.add_argument('-w', '--workers', type=int, help='number of worker processes (default: one per core)')
+    video.add_argument('-q', '--queue-size', type=int, default=8, help='frames allowed to wait between stages')
+    args = parser.parse_args(argv)
+
+    if args.command == 'video':
+        color = not args.greyscale
+        try:
+            filt = parse_filters(args.filters, color)
+            if args.raw:
+                width, height = (int(v) for v in args.raw.lower().split('x'))
+        except ValueError as e:
+            parser.error(str(e))
+        if args.raw:
+            with open(args.input, 'rb') as source, open(args.output, 'wb') as sink:
+                summary = process_frames(raw_frames(source, width, height, color), filt, raw_writer(sink, color),
+                                         args.workers, args.queue_size)
+        else:
+            summary = process_frames(png_frames(args.input, color), filt, png_writer(args.output, color),
+                                     args.workers, args.queue_size)
+        print('%d frames in %.3fs with %d workers: %.2f frames/s'
+              % (summary['frames'], summary['seconds'], summary['workers'], summary['frames_per_second']))
+    elif args.command == 'bench':
+        if any(not 1 <= size <= BENCH_SIZES[-1] for size in args.sizes):
+            parser.error('sizes must be between 1 and %d' % BENCH_SIZES[-1])
+        results = run_benchmarks(args.sizes, args.repeat, args.memory)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump({'python': sys.version, 'platform': sys.platform, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,6 +1,7 @@
 # 6.009 Lab 2: Snekoban
 
 import json
+import heapq
 import typing
 
 # NO ADDITIONAL IMPORTS!
@@ -13,19 +14,6 @@ direction_vector = {
     "right": (0, +1),
 }
 
-def getdirec(direc):
-    '''Return Direction vector given direction'''
-    if direc=='up':
-        return [-1,0]
-    elif direc=='down':
-        return [1,0]
-    elif direc=='left':
-        return [0,-1]
-    elif direc=='right':
-        return [0,1]
-
-
-
 def new_game(level_description):
     """
     Given a description of a game state, return dictionary of coordinates of important components
@@ -41,7 +29,11 @@ def new_game(level_description):
     ]
 
     A dictionary will be returned with keys for computers, player, walls, and targets, with corresponding sets containing coordinates of these components
-    
+
+    These are then packed into bitboards (see _bitboard_game): the game that
+    is returned holds the player's cell, the bitmask of computer cells, and the
+    board (walls, targets and the neighbours of every cell), which never
+    changes and is shared by every game that step_game makes from it.
     """
 
     height = len(level_description)
@@ -66,7 +58,7 @@ def new_game(level_description):
                     newgame['computers'].add((i,j))
                 elif (level_description[i][j][0] == 'target'): #check if target
                     newgame['targets'].add((i,j))
-    return newgame
+    return _bitboard_game(newgame)
 
 
 def victory_check(game):
@@ -75,8 +67,8 @@ def victory_check(game):
     a Boolean: True if the given game satisfies the victory condition, and
     False otherwise.
     """
-    if(len(game['computers'])!=0): #if 0 computers, game is false
-        if(game['computers']==game['targets']): # The coordinates of computers and targets must all be the same, no extras allowed
+    if(game['computers']!=0): #if 0 computers, game is false
+        if(game['computers']==game['board']['targets']): # The computer and target cells must all be the same, no extras allowed
             return True
     return False
 
@@ -84,40 +76,26 @@ def victory_check(game):
 
 
 def step_game(game, direction):
-    '''Given game and direction, returns updated board with move made in that direction'''
-    newgame = {'computers': game['computers'].copy(), 'walls': game['walls'].copy(), 'player': game['player'].copy(), 'targets': game['targets'].copy(), 'height': game['height'], 'width': game['width']}
-    for e in game['player']:
-        playerpos=e
-
-    playh=playerpos[0] # Take coordinates of player
-    playw=playerpos[1]
-    x=getdirec(direction)[0] #Takes direction coordinates
-    y=getdirec(direction)[1]
-    if (x + playh < 0 or x + playh > (game['height'] - 1)): # checks if move is in game board
-        return newgame
-    if (y + playw < 0 or y + playw > (game['width'] - 1)):
-        return newgame
-    if((playh+x,playw+y) in game['walls']): #stops if wall in next space
-        return newgame
-    if ((playh+x,playw+y) not in game['computers']): # moves once if possible (no wall or computer)
-        newgame['player'].remove((playh,playw))
-        newgame['player'].add((playh+x,playw+y))
-        return newgame
-    if not (0<= 2*x+playh <=(game['height'] - 1)): #Must be a computer, so see if 2 steps away from player is in board
-        return newgame
-    if not (0<= 2*y+playw <=(game['width'] - 1)):
-        return newgame
-    if((playh+2*x,playw+2*y) in game['computers'] or (playh+2*x,playw+2*y) in game['walls']): # Nothing to do if 2 steps away from player is not empty
-        return newgame
-    newgame['player'].remove((playh, playw)) # Remove player initial coordinates
-    newgame['player'].add((playh + x, playw + y)) # Add player new coordinares
-    newgame['computers'].remove((playh+x, playw+y)) # Add computer old coordinates
-    newgame['computers'].add((playh + 2*x, playw + 2*y)) # Add computer new coordinates
-    return newgame
-        
-
-
-
+    '''
+    Given game and direction, returns updated board with move made in that direction
+
+    Only the player's cell and, after a push, the computers bitmask are new;
+    the board is shared.  Games are never modified, so when the move changes
+    nothing the given game itself is returned.
+    '''
+    board = game['board']
+    d = direction_number[direction]
+    neighbors = board['neighbors']
+    nxt = neighbors[game['player']][d] # None if a wall or the edge is in the way
+    if nxt is None:
+        return game
+    computers = game['computers']
+    if computers >> nxt & 1: # push the computer if there is room behind it
+        beyond = neighbors[nxt][d]
+        if beyond is None or computers >> beyond & 1:
+            return game
+        computers ^= (1 << nxt) | (1 << beyond)
+    return {'board': board, 'player': nxt, 'computers': computers}
 
 
 def dump_game(game):
@@ -128,68 +106,650 @@ def dump_game(game):
 
     
     """
+    board = game['board']
+    width = board['width']
     newgame=[]
-    for i in range(game['height']):
+    for i in range(board['height']):
         newgame.append([])
-        for j in range(game['width']):
+        for j in range(width):
             newgame[i].append([])
-    for e in game['walls']:
+    for e in _mask_cells(board['walls'], width):
         newgame[e[0]][e[1]].append('wall')
-    for e in game['targets']:
+    for e in _mask_cells(board['targets'], width):
         newgame[e[0]][e[1]].append('target')
-    for e in game['computers']:
+    for e in _mask_cells(game['computers'], width):
         newgame[e[0]][e[1]].append('computer')
-    for e in game['player']:
-        newgame[e[0]][e[1]].append('player')
+    e = divmod(game['player'], width)
+    newgame[e[0]][e[1]].append('player')
     return newgame
 
 
-def solve_puzzle(game):
-    """
-    Given dictionary of game components and coordinates, find a
-    solution.
-
-    Return a list of strings representing the shortest sequence of moves ("up",
-    "down", "left", and "right") needed to reach the victory condition.
-
-    If the given level cannot be solved, return None.
-    """
-    targets = game['targets']
-    walls = game['walls']
+# BITBOARDS
+#
+# Cells are numbered row by row (cell i*width + j), and sets of cells are kept
+# as bitmasks (bit c set if cell c is in the set).  A game is a dictionary
+# with the player's cell, the bitmask of the computer cells, and the board: a
+# dictionary shared by all the games of a level, with its height and width,
+# the walls and targets bitmasks, and for every cell its neighbour in each of
+# DIRECTIONS (None if that is off the board or a wall).
+#
+# The solver describes a position by a State: the player's cell and the
+# computers bitmask, plus a Zobrist hash (the XOR of a fixed random key for
+# the player's cell and one for every computer cell), updated with a couple of
+# XORs per move instead of being recomputed.  Equal positions always give
+# equal states, however they were reached, so visited sets catch every
+# duplicate.
+
+DIRECTIONS = ('up', 'down', 'left', 'right')
+direction_number = {direc: d for d, direc in enumerate(DIRECTIONS)}
+
+
+def _bitboard_game(game):
+    '''
+    The bitboard game for a game given as sets of (row, column) coordinates
+    under 'computers', 'walls', 'player' and 'targets', plus 'height' and
+    'width'.
+    '''
     height = game['height']
     width = game['width']
-    computers = game['computers'].copy() # Makes copy of computer set
-    player = game['player'].copy() # Makes copy of player coordinate set
-    d={'player':player,'computers':computers,'moves':[]} # creates dictionary with players, computers, and moves, Everything that can change
-    positions=[d] # our queue of dictionaries of positions and moves
-    visited=set() #Lets us see positions we have already been to
-    a=1
-    new=d
-    while(a!=0): # While no solution found
-        if(len(positions)==0): #If no more configurations to consider, no solutions possible
-            return None
-        new=positions.pop(0) #pop oldest element of queue to check as it is closest to initial position
-        newgame={'player':new['player'], 'computers':new['computers'], 'targets':targets,'walls':walls,'height':height,'width':width}
-        if (victory_check(newgame) == True): #checks if we are done
-            a=0
+    walls = _cell_mask(game['walls'], width)
+    neighbors = []
+    for cell in range(height*width):
+        i, j = divmod(cell, width)
+        around = []
+        for direc in DIRECTIONS:
+            di, dj = direction_vector[direc]
+            ni, nj = i+di, j+dj
+            if 0 <= ni < height and 0 <= nj < width and not walls >> (ni*width + nj) & 1:
+                around.append(ni*width + nj)
+            else:
+                around.append(None)
+        neighbors.append(around)
+    board = {'height': height, 'width': width, 'walls': walls,
+             'targets': _cell_mask(game['targets'], width), 'neighbors': neighbors}
+    (i, j), = game['player']
+    return {'board': board, 'player': i*width + j, 'computers': _cell_mask(game['computers'], width)}
+
+
+def _splitmix64(seed):
+    '''
+    Generate pseudo-random 64-bit integers from seed (the splitmix64
+    generator), so the Zobrist keys are the same in every run.
+    '''
+    mask = (1 << 64) - 1
+    while True:
+        seed = (seed + 0x9E3779B97F4A7C15) & mask
+        z = seed
+        z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & mask
+        z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & mask
+        yield z ^ (z >> 31)
+
+
+class State:
+    '''
+    A position during the search: the player's cell, the bitmask of computer
+    cells, and the Zobrist hash of both.
+    '''
+    __slots__ = ('player', 'computers', 'key')
+
+    def __init__(self, player, computers, key):
+        self.player = player
+        self.computers = computers
+        self.key = key
+
+    def __hash__(self):
+        return self.key
+
+    def __eq__(self, other):
+        return self.player == other.player and self.computers == other.computers
+
+    def __repr__(self):
+        return 'State(%d, %s)' % (self.player, bin(self.computers))
+
+
+def _cell_mask(cells, width):
+    '''Bitmask of a set of (row, column) coordinates'''
+    mask = 0
+    for i, j in cells:
+        mask |= 1 << (i*width + j)
+    return mask
+
+
+def _mask_bits(mask):
+    '''The numbers of the bits set in mask, lowest first'''
+    bits = []
+    while mask:
+        low = mask & -mask
+        bits.append(low.bit_length() - 1)
+        mask ^= low
+    return bits
+
+
+def _mask_cells(mask, width):
+    '''Set of the (row, column) coordinates of the bits set in mask'''
+    return {divmod(bit, width) for bit in _mask_bits(mask)}
+
+
+def _search_level(game):
+    '''
+    The board of a game, with what only the solver needs worked out the first
+    time it is searched: the dead squares (see _dead_squares) and the Zobrist
+    keys.
+    '''
+    board = game['board']
+    if 'dead' not in board:
+        size = board['height'] * board['width']
+        keys = _splitmix64(size)
+        board['dead'] = _dead_squares(board['neighbors'], board['targets'])
+        board['player_keys'] = [next(keys) for _ in range(size)]
+        board['computer_keys'] = [next(keys) for _ in range(size)]
+    return board
+
+
+def _opposite(d):
+    '''Number of the direction opposite to DIRECTIONS[d]'''
+    return d ^ 1
+
+
+def _dead_squares(neighbors, targets):
+    '''
+    Bitmask of the cells from which a computer could never be pushed onto any
+    target, even with no other computers in the way.  It is the complement of
+    the cells reached by pulling computers off the targets: a computer on cell
+    c can have come from the cell before c in some direction if the player had
+    room to stand behind it.
+    '''
+    live = targets
+    stack = _mask_bits(targets)
+    while stack:
+        cell = stack.pop()
+        for d in range(len(DIRECTIONS)):
+            back = _opposite(d)
+            before = neighbors[cell][back] # where the computer was before being pushed in direction d
+            if before is None or live >> before & 1 or neighbors[before][back] is None:
+                continue
+            live |= 1 << before
+            stack.append(before)
+    return ((1 << len(neighbors)) - 1) & ~live
+
+
+def _frozen(level, computers, cell, fixed=0):
+    '''
+    If the computer on cell can never be pushed again, return the bitmask of
+    the computers (itself included) that hold each other in place; otherwise
+    return 0.  Along each axis a computer is stuck if there is a wall (or a
+    computer in fixed) on either side, if both sides are dead squares, or if
+    a computer on either side is itself stuck, treating this one as a wall.
+    '''
+    around = level['neighbors'][cell]
+    dead = level['dead']
+    fixed |= 1 << cell
+    stuck = 1 << cell
+    for d1, d2 in ((0, 1), (2, 3)): # up/down, then left/right
+        a, b = around[d1], around[d2]
+        if a is None or b is None or fixed >> a & 1 or fixed >> b & 1:
+            continue
+        if dead >> a & 1 and dead >> b & 1:
+            continue
+        for side in (a, b):
+            if computers >> side & 1:
+                held = _frozen(level, computers, side, fixed)
+                if held:
+                    stuck |= held
+                    break
         else:
-            setofdirec=['up','down','left','right']
-            for dir in setofdirec: #For every direction, move player once in that direction
-                game1=step_game(newgame,dir) #creates new positions
-                v=(tuple(game1['player']),tuple(game1['computers'])) # Creates tuple for visited for new position
-                if (v not in visited): # Makes sure we are considering a new position
-                    visited.add(v)
-                    moves=new['moves'][:]
-                    moves.append(dir) # Updates move list with new move
-                    positions.append({'player':game1['player'],'computers':game1['computers'],'moves':moves}) # If it is a new position, we add it to our queue           
-            a=1 # keep loop going
-    return new['moves']
+            return 0
+    return stuck
+
+
+def _deadlocked(level, computers, cell):
+    '''
+    Whether the position can no longer be won after a computer was pushed onto
+    cell: it is on a dead square, or frozen together with computers of which
+    at least one is not on a target.
+    '''
+    if level['dead'] >> cell & 1:
+        return True
+    return bool(_frozen(level, computers, cell) & ~level['targets'])
+
+
+def _make_state(level, player, computers):
+    '''The State for the player in cell player and the computers bitmask'''
+    key = level['player_keys'][player]
+    for cell in _mask_bits(computers):
+        key ^= level['computer_keys'][cell]
+    return State(player, computers, key)
+
+
+def _game_state(level, game):
+    '''The State of a game representation (of the form returned by new_game)'''
+    return _make_state(level, game['player'], game['computers'])
+
+
+def _step_state(level, state, d):
+    '''
+    The state after moving in DIRECTIONS[d], or None if the move changes
+    nothing (the player walks into a wall, the edge, or a computer that cannot
+    be pushed).
+    '''
+    neighbors = level['neighbors']
+    player = state.player
+    nxt = neighbors[player][d]
+    if nxt is None:
+        return None
+    computers = state.computers
+    key = state.key ^ level['player_keys'][player] ^ level['player_keys'][nxt]
+    if computers >> nxt & 1: # push the computer one cell further
+        beyond = neighbors[nxt][d]
+        if beyond is None or computers >> beyond & 1:
+            return None
+        computers ^= (1 << nxt) | (1 << beyond)
+        key ^= level['computer_keys'][nxt] ^ level['computer_keys'][beyond]
+    return State(nxt, computers, key)
 
 
+def _solved(level, computers):
+    '''Same as victory_check, for a computers bitmask'''
+    return computers != 0 and computers == level['targets']
 
 
+def _path(parents, state):
+    '''
+    The moves leading to state, following the (parent, direction number)
+    pointers in parents back to the start (whose entry is None).
+    '''
+    moves = []
+    while parents[state] is not None:
+        state, d = parents[state]
+        moves.append(DIRECTIONS[d])
+    moves.reverse()
+    return moves
 
 
+def solve_puzzle(game, strategy='bfs', stats=None, cache=None):
+    """
+    Given dictionary of game components and coordinates, find a
+    solution.
+
+    Return a list of strings representing the shortest sequence of moves ("up",
+    "down", "left", and "right") needed to reach the victory condition.
 
+    If the given level cannot be solved, return None.
 
-    
+    strategy picks the search (see SOLVERS):
+      'bfs'     breadth-first search over single moves
+      'moves'   A* over pushes, counting the walking in between: also the
+                shortest sequence of moves, and much faster on big levels
+      'pushes'  A* over pushes only: a solution with the fewest pushes, which
+                may take more moves than the shortest one
+      'bidirectional'  breadth-first search over single moves from both ends
+                at once (see _bidirectional): the shortest sequence of moves
+    Pushes that leave the level unwinnable (see _deadlocked) are never
+    followed; no solution goes through them, so what is returned is still
+    optimal.
+
+    If stats is a dictionary, the number of states expanded ('expanded') and
+    the largest number waiting to be expanded at once ('peak_frontier') are
+    stored in it.
+
+    If cache is given (a lab2_batch.SolutionCache, or anything else with the
+    same lookup and store methods), the answer is looked up there first, and
+    stored there if it had to be searched for.  Answers are only shared
+    between searches with the same strategy, so an answer from the cache is
+    just as short.
+    """
+    if strategy not in SOLVERS:
+        raise ValueError('unknown strategy %r, expected one of %s' % (strategy, ', '.join(SOLVERS)))
+    if stats is None:
+        stats = {}
+    stats.update(expanded=0, peak_frontier=0)
+    if cache is not None:
+        found, solution = cache.lookup(game, strategy)
+        if found:
+            return solution
+    level = _search_level(game)
+    start = _game_state(level, game)
+    if _solved(level, start.computers):
+        solution = []
+    elif start.computers.bit_count() != level['targets'].bit_count() or start.computers & level['dead']:
+        solution = None
+    else:
+        solution = SOLVERS[strategy](level, start, stats)
+    if cache is not None:
+        cache.store(game, solution, strategy)
+    return solution
+
+
+def _bfs(level, start, stats):
+    '''
+    Breadth-first search over single moves from start.  Every State is stored
+    once with a pointer to the state it was reached from, so the moves are only
+    put together for the solution.
+    '''
+    parents = {start: None} # every state seen, with (previous state, direction number)
+    queue = [start]
+    head = 0 # queue[head:] still has to be expanded
+    peak = 1
+    try:
+        while head < len(queue):
+            peak = max(peak, len(queue) - head)
+            state = queue[head]
+            queue[head] = None # expanded states are only needed in parents
+            head += 1
+            for d in range(len(DIRECTIONS)):
+                new = _step_state(level, state, d)
+                if new is None or new in parents:
+                    continue
+                pushed = new.computers & ~state.computers
+                if pushed and _deadlocked(level, new.computers, pushed.bit_length() - 1):
+                    continue
+                parents[new] = (state, d)
+                if _solved(level, new.computers):
+                    return _path(parents, new)
+                queue.append(new)
+        return None
+    finally:
+        stats['expanded'] = head
+        stats['peak_frontier'] = peak
+
+
+def _pull_states(level, state, d):
+    '''
+    The states from which moving in DIRECTIONS[d] leads to state: the player
+    one cell back, having either just walked or pushed the computer in front
+    of it (if there is one) into its cell.
+    '''
+    neighbors = level['neighbors']
+    player = state.player
+    previous = neighbors[player][_opposite(d)]
+    computers = state.computers
+    if previous is None or computers >> previous & 1:
+        return []
+    key = state.key ^ level['player_keys'][player] ^ level['player_keys'][previous]
+    states = [State(previous, computers, key)]
+    front = neighbors[player][d]
+    if front is not None and computers >> front & 1: # pull it back
+        key ^= level['computer_keys'][front] ^ level['computer_keys'][player]
+        states.append(State(previous, computers ^ (1 << front) ^ (1 << player), key))
+    return states
+
+
+def _bidirectional(level, start, stats):
+    '''
+    Breadth-first search from start forwards and, at the same time, from every
+    winning position (computers on all the targets, player on any other free
+    cell) backwards through _pull_states.  Each round expands a whole level of
+    the side with the smaller frontier; as soon as the two sides meet, the
+    shortest of the paths through the states where they met in that round is
+    returned, which is a shortest solution.  On long solutions each side only
+    has to go about half as deep.
+    '''
+    targets = level['targets']
+    goals = [_make_state(level, cell, targets) for cell in range(len(level['neighbors']))
+             if not (level['walls'] | targets) >> cell & 1]
+    forward = {start: None} # state -> (previous state, direction number)
+    backward = {goal: None for goal in goals} # state -> (next state, direction number)
+    frontier = [start]
+    back_frontier = goals
+    while frontier and back_frontier:
+        stats['peak_frontier'] = max(stats['peak_frontier'], len(frontier) + len(back_frontier))
+        meetings = []
+        if len(frontier) <= len(back_frontier):
+            stats['expanded'] += len(frontier)
+            next_frontier = []
+            for state in frontier:
+                for d in range(len(DIRECTIONS)):
+                    new = _step_state(level, state, d)
+                    if new is None or new in forward:
+                        continue
+                    pushed = new.computers & ~state.computers
+                    if pushed and _deadlocked(level, new.computers, pushed.bit_length() - 1):
+                        continue
+                    forward[new] = (state, d)
+                    if new in backward:
+                        meetings.append(new)
+                    next_frontier.append(new)
+            frontier = next_frontier
+        else:
+            stats['expanded'] += len(back_frontier)
+            next_frontier = []
+            for state in back_frontier:
+                for d in range(len(DIRECTIONS)):
+                    for new in _pull_states(level, state, d):
+                        if new in backward:
+                            continue
+                        backward[new] = (state, d)
+                        if new in forward:
+                            meetings.append(new)
+                        next_frontier.append(new)
+            back_frontier = next_frontier
+        if meetings:
+            best = min(meetings, key=lambda s: _path_length(forward, s) + _path_length(backward, s))
+            moves = _path(forward, best)
+            while backward[best] is not None:
+                best, d = backward[best]
+                moves.append(DIRECTIONS[d])
+            return moves
+    return None
+
+
+def _path_length(parents, state):
+    '''The number of steps back to the start from state, through parents'''
+    length = 0
+    while parents[state] is not None:
+        state = parents[state][0]
+        length += 1
+    return length
+
+
+# PUSH SEARCH
+#
+# Between two pushes the player can walk anywhere it can reach, so a search
+# over pushes only looks at the positions right after each push.  For the
+# fewest pushes, where the player stands does not matter within the region it
+# can reach, so positions are stored with the top-left cell of that region
+# (its canonical position) and many move-level states become one.  For the
+# fewest moves, the player's exact cell is kept and each push costs the walk
+# to it plus one.  Both are A* searches; the heuristic is the cheapest way of
+# matching computers to targets, one each, counting for each computer the
+# pushes it would need with nothing else in the way.
+
+def _walk_distances(level, player, computers):
+    '''
+    The cells the player can reach from cell player without pushing anything,
+    as a dictionary mapping each one to (number of moves, previous cell,
+    direction number of the last move).
+    '''
+    neighbors = level['neighbors']
+    reached = {player: (0, None, None)}
+    queue = [player]
+    for cell in queue:
+        steps = reached[cell][0] + 1
+        for d, nxt in enumerate(neighbors[cell]):
+            if nxt is not None and nxt not in reached and not computers >> nxt & 1:
+                reached[nxt] = (steps, cell, d)
+                queue.append(nxt)
+    return reached
+
+
+def _push_distances(level):
+    '''
+    For every target, a list giving for each cell the fewest pushes that move
+    a computer from that cell onto the target with no other computers in the
+    way (None if it cannot be done), found by pulling it off the target.
+    '''
+    neighbors = level['neighbors']
+    tables = []
+    for target in _mask_bits(level['targets']):
+        distance = [None] * len(neighbors)
+        distance[target] = 0
+        queue = [target]
+        for cell in queue:
+            for d in range(len(DIRECTIONS)):
+                back = _opposite(d)
+                before = neighbors[cell][back]
+                if before is None or distance[before] is not None or neighbors[before][back] is None:
+                    continue
+                distance[before] = distance[cell] + 1
+                queue.append(before)
+        tables.append(distance)
+    return tables
+
+
+def _min_assignment(cost):
+    '''
+    The smallest total cost of assigning each row of the square matrix cost to
+    a different column (the Hungarian algorithm, O(n^3)).
+    '''
+    n = len(cost)
+    u = [0] * (n+1) # potentials of the rows and columns
+    v = [0] * (n+1)
+    match = [0] * (n+1) # row assigned to each column (1-based, 0 for none)
+    way = [0] * (n+1)
+    for row in range(1, n+1):
+        match[0] = row
+        column = 0
+        slack = [float('inf')] * (n+1)
+        used = [False] * (n+1)
+        while True:
+            used[column] = True
+            r = match[column]
+            delta = float('inf')
+            best = 0
+            for j in range(1, n+1):
+                if not used[j]:
+                    reduced = cost[r-1][j-1] - u[r] - v[j]
+                    if reduced < slack[j]:
+                        slack[j] = reduced
+                        way[j] = column
+                    if slack[j] < delta:
+                        delta = slack[j]
+                        best = j
+            for j in range(n+1):
+                if used[j]:
+                    u[match[j]] += delta
+                    v[j] -= delta
+                else:
+                    slack[j] -= delta
+            column = best
+            if match[column] == 0:
+                break
+        while column: # flip the augmenting path
+            previous = way[column]
+            match[column] = match[previous]
+            column = previous
+    return -v[0]
+
+
+def _push_heuristic(level, distances):
+    '''
+    Returns a function giving, for a computers bitmask, a lower bound on the
+    pushes still needed (see _min_assignment), or None if the computers cannot
+    all reach different targets.  Results are remembered per bitmask.
+    '''
+    unreachable = len(level['neighbors']) * len(distances) + 1 # more than any real matching costs
+    known = {}
+    def heuristic(computers):
+        if computers not in known:
+            cost = [[unreachable if table[cell] is None else table[cell] for table in distances]
+                    for cell in _mask_bits(computers)]
+            total = _min_assignment(cost)
+            known[computers] = total if total < unreachable else None
+        return known[computers]
+    return heuristic
+
+
+def _push_search(level, start, stats, push_optimal):
+    '''
+    A* search over pushes from start (see PUSH SEARCH above), for the fewest
+    pushes if push_optimal and otherwise for the fewest moves.
+    '''
+    heuristic = _push_heuristic(level, _push_distances(level))
+    neighbors = level['neighbors']
+    player_keys = level['player_keys']
+    computer_keys = level['computer_keys']
+    first = heuristic(start.computers)
+    if first is None:
+        return None
+    root = start
+    if push_optimal:
+        corner = min(_walk_distances(level, start.player, start.computers))
+        root = State(corner, start.computers, start.key ^ player_keys[start.player] ^ player_keys[corner])
+    parents = {root: None} # state -> (previous state, cell pushed from, direction number)
+    costs = {root: 0}
+    heap = [(first, first, 0, root)] # (cost + heuristic, heuristic, tie-breaker, state)
+    count = 1
+    while heap:
+        stats['peak_frontier'] = max(stats['peak_frontier'], len(heap))
+        total, estimate, _, state = heapq.heappop(heap)
+        cost = total - estimate
+        if cost > costs[state]:
+            continue # already reached more cheaply
+        stats['expanded'] += 1
+        if _solved(level, state.computers):
+            return _push_path(level, parents, state, start)
+        computers = state.computers
+        for cell, (steps, _, _) in _walk_distances(level, state.player, computers).items():
+            for d in range(len(DIRECTIONS)):
+                box = neighbors[cell][d]
+                if box is None or not computers >> box & 1:
+                    continue
+                beyond = neighbors[box][d]
+                if beyond is None or computers >> beyond & 1:
+                    continue
+                moved = computers ^ (1 << box) ^ (1 << beyond)
+                if _deadlocked(level, moved, beyond):
+                    continue
+                estimate = heuristic(moved)
+                if estimate is None:
+                    continue
+                if push_optimal:
+                    player, new_cost = min(_walk_distances(level, box, moved)), cost + 1
+                else:
+                    player, new_cost = box, cost + steps + 1
+                key = state.key ^ player_keys[state.player] ^ player_keys[player] ^ computer_keys[box] ^ computer_keys[beyond]
+                new = State(player, moved, key)
+                if new_cost < costs.get(new, new_cost + 1):
+                    costs[new] = new_cost
+                    parents[new] = (state, cell, d)
+                    heapq.heappush(heap, (new_cost + estimate, estimate, count, new))
+                    count += 1
+    return None
+
+
+def _push_path(level, parents, state, start):
+    '''
+    The moves of a push search solution ending in state: each push, with the
+    walk to it, replayed from the start position.
+    '''
+    pushes = []
+    while parents[state] is not None:
+        state, cell, d = parents[state]
+        pushes.append((cell, d))
+    pushes.reverse()
+    neighbors = level['neighbors']
+    player = start.player
+    computers = start.computers
+    moves = []
+    for cell, d in pushes:
+        reached = _walk_distances(level, player, computers)
+        walk = []
+        here = cell
+        while here != player:
+            _, here, step = reached[here]
+            walk.append(DIRECTIONS[step])
+        moves.extend(reversed(walk))
+        moves.append(DIRECTIONS[d])
+        box = neighbors[cell][d]
+        beyond = neighbors[box][d]
+        player = box
+        computers ^= (1 << box) | (1 << beyond)
+    return moves
+
+
+SOLVERS = {
+    'bfs': _bfs,
+    'moves': lambda level, start, stats: _push_search(level, start, stats, push_optimal=False),
+    'pushes': lambda level, start, stats: _push_search(level, start, stats, push_optimal=True),
+    'bidirectional': _bidirectional,
+}
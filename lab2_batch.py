@@ -0,0 +1,336 @@
+"""
+Tools built on the lab 2 solver: a persistent SQLite cache of solutions, and
+solving whole level packs in worker processes with per-level time and memory
+limits.  Run with --help for usage.
+"""
+
+import sys
+import json
+import time
+import signal
+import sqlite3
+import hashlib
+import argparse
+import concurrent.futures
+
+try:
+    import resource # for memory limits; only available on Unix
+except ImportError:
+    resource = None
+
+from lab2 import new_game, step_game, solve_puzzle, DIRECTIONS, direction_number, SOLVERS, _walk_distances
+
+
+# SOLUTION CACHE
+#
+# Solutions are kept in an SQLite database so that positions solved before,
+# by this process or another one, are answered without searching.  Every
+# position along a stored solution gets an entry pointing into it, so a hint
+# asked for halfway through a level is found too.  Entries are kept apart per
+# strategy, so an answer from the cache is as good as the search would have
+# given.  Positions are identified by the walls, targets and computers and
+# where the player is: its exact cell for the strategies that give the fewest
+# moves (MOVE_OPTIMAL), where a walk to another cell would make the answer
+# longer than necessary, and otherwise the region it can walk around in (by
+# its top-left cell), since the number of pushes needed does not depend on
+# where in that region the player stands.
+
+MOVE_OPTIMAL = ('bfs', 'moves', 'bidirectional')
+
+class SolutionCache:
+    '''
+    A solution cache stored in the SQLite database filename, holding about
+    max_positions positions; when there are more, the ones used least
+    recently are dropped (a tenth of max_positions at a time), along with
+    stored solutions no longer used by any.
+    '''
+    def __init__(self, filename, max_positions=1000000):
+        self.max_positions = max_positions
+        self.connection = sqlite3.connect(filename, timeout=60)
+        self.count = None # positions in the cache, kept up to date by store
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS solutions (id INTEGER PRIMARY KEY, strategy TEXT, moves TEXT)')
+            # one row per position: the solution it is on (NULL if it cannot be
+            # solved), where in it the rest of the moves start, the player's
+            # cell at that point, how many moves are left, and when it was last used
+            self.connection.execute('CREATE TABLE IF NOT EXISTS positions (key BLOB PRIMARY KEY, solution INTEGER, '
+                                    'start INTEGER, player INTEGER, remaining INTEGER, used REAL)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS positions_used ON positions (used)')
+
+    def lookup(self, game, strategy):
+        '''
+        Returns (True, solution) if the position of game has been solved with
+        strategy, with solution None if it is known to have none, and
+        (False, None) if not.  For strategies not in MOVE_OPTIMAL, if the
+        player is not on the cell where the stored solution continues from, a
+        shortest walk there (within its region) is put in front.
+        '''
+        key = _cache_key(game, strategy)
+        row = self.connection.execute('SELECT solution, start, player FROM positions WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return False, None
+        number, start, player = row
+        with self.connection:
+            self.connection.execute('UPDATE positions SET used = ? WHERE key = ?', (time.time(), key))
+        if number is None:
+            return True, None
+        moves, = self.connection.execute('SELECT moves FROM solutions WHERE id = ?', (number,)).fetchone()
+        reached = _walk_distances(game['board'], game['player'], game['computers'])
+        walk = []
+        while player != game['player']:
+            _, player, d = reached[player]
+            walk.append(DIRECTIONS[d])
+        walk.reverse()
+        return True, walk + [DIRECTIONS[_MOVE_LETTERS.index(letter)] for letter in moves[start:]]
+
+    def store(self, game, solution, strategy):
+        '''
+        Store the solution found by strategy (a list of moves, or None if
+        there is none) of the position of game, and of every position along
+        it.  A position already in the cache keeps its entry unless this one
+        leaves fewer moves.
+        '''
+        now = time.time()
+        with self.connection:
+            if self.count is None:
+                self.count, = self.connection.execute('SELECT COUNT(*) FROM positions').fetchone()
+            if solution is None:
+                rows = {_cache_key(game, strategy): (None, 0, game['player'], None, now)}
+                self.count += self._new_keys(rows)
+                self.connection.execute('INSERT OR REPLACE INTO positions VALUES (?, ?, ?, ?, ?, ?)',
+                                        [(key,) + row for key, row in rows.items()][0])
+            else:
+                moves = ''.join(_MOVE_LETTERS[direction_number[direc]] for direc in solution)
+                number = self.connection.execute('INSERT INTO solutions (strategy, moves) VALUES (?, ?)',
+                                                 (strategy, moves)).lastrowid
+                positions = [game]
+                for direc in solution:
+                    positions.append(step_game(positions[-1], direc))
+                # the last entry for a position is the one closest to the next push
+                rows = {}
+                for start, position in enumerate(positions):
+                    rows[_cache_key(position, strategy)] = (number, start, position['player'], len(solution) - start, now)
+                self.count += self._new_keys(rows)
+                self.connection.executemany(
+                    'INSERT INTO positions VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (key) DO UPDATE SET '
+                    'solution = excluded.solution, start = excluded.start, player = excluded.player, '
+                    'remaining = excluded.remaining, used = excluded.used '
+                    'WHERE positions.remaining IS NOT NULL AND excluded.remaining < positions.remaining',
+                    [(key,) + row for key, row in rows.items()])
+            self._evict()
+
+    def _new_keys(self, rows):
+        '''How many of the keys of rows are not in the cache yet'''
+        keys = list(rows)
+        known = 0
+        for i in range(0, len(keys), 500): # stay under SQLite's limit on parameters
+            part = keys[i:i+500]
+            known += self.connection.execute('SELECT COUNT(*) FROM positions WHERE key IN (%s)' % ','.join('?' * len(part)),
+                                             part).fetchone()[0]
+        return len(keys) - known
+
+    def _evict(self):
+        '''
+        Once there are more than max_positions positions, drop the least
+        recently used ones, down to nine tenths of max_positions.  The running
+        count is checked against the table first, since other processes may
+        have changed it.
+        '''
+        if self.count <= self.max_positions:
+            return
+        self.count, = self.connection.execute('SELECT COUNT(*) FROM positions').fetchone()
+        if self.count <= self.max_positions:
+            return
+        excess = self.count - self.max_positions * 9 // 10
+        self.connection.execute('DELETE FROM positions WHERE key IN (SELECT key FROM positions ORDER BY used LIMIT ?)',
+                                (excess,))
+        self.connection.execute('DELETE FROM solutions WHERE id NOT IN '
+                                '(SELECT solution FROM positions WHERE solution IS NOT NULL)')
+        self.count -= excess
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+_MOVE_LETTERS = 'udlr' # how DIRECTIONS are written in stored solutions
+
+
+def _cache_key(game, strategy):
+    '''
+    The key of the position of game in a SolutionCache for strategy: a hash of
+    the strategy, the size, walls, targets and computers of the level, and the
+    player's cell (for strategies in MOVE_OPTIMAL) or the top-left cell of the
+    region it can walk around in.
+    '''
+    board = game['board']
+    if strategy in MOVE_OPTIMAL:
+        player = game['player']
+    else:
+        player = min(_walk_distances(board, game['player'], game['computers']))
+    text = '%s %d %d %x %x %x %d' % (strategy, board['height'], board['width'], board['walls'],
+                                     board['targets'], game['computers'], player)
+    return hashlib.blake2b(text.encode(), digest_size=16).digest()
+
+
+# LEVEL PACKS
+#
+# Solving many levels at once: every level is solved in a worker process with
+# its own time limit and (on Unix) memory limit, and the solutions are written
+# out together with the search statistics from solve_puzzle.
+
+class LevelTimeout(Exception):
+    '''Raised in a worker when a level runs out of time'''
+
+
+def _time_up(signum, frame):
+    raise LevelTimeout()
+
+
+def load_levels(filename):
+    '''
+    Read a level pack: a JSON file holding either a list of level descriptions
+    (as taken by new_game) or an object mapping level names to them.  Returns a
+    list of (name, description) pairs; levels in a list are named by their
+    position, starting from 1.
+    '''
+    with open(filename) as f:
+        pack = json.load(f)
+    if isinstance(pack, dict):
+        return list(pack.items())
+    return [(str(number), level) for number, level in enumerate(pack, 1)]
+
+
+def _solve_level(task):
+    '''
+    Solve one level in a worker process.  task is (name, level description,
+    strategy, time limit in seconds, memory limit in bytes, SolutionCache
+    file name); the limits are ignored if None, or where the platform cannot
+    enforce them, and so is the cache.  Returns a result dictionary (see
+    solve_levels).
+    '''
+    name, description, strategy, time_limit, memory_limit, cache_file = task
+    stats = {'expanded': 0, 'peak_frontier': 0, 'seconds': 0.0}
+    begin = time.perf_counter()
+    solution = error = cache = None
+    old_limit = None
+    if memory_limit and resource is not None:
+        old_limit = resource.getrlimit(resource.RLIMIT_AS)
+        hard = old_limit[1]
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit if hard == resource.RLIM_INFINITY else min(memory_limit, hard), hard))
+    timed = time_limit and hasattr(signal, 'setitimer')
+    if timed:
+        signal.signal(signal.SIGALRM, _time_up)
+        signal.setitimer(signal.ITIMER_REAL, time_limit)
+    try:
+        try:
+            cache = SolutionCache(cache_file) if cache_file else None
+            solution = solve_puzzle(new_game(description), strategy, stats, cache)
+        finally: # disarmed before any handler below runs, so none of them can be interrupted
+            if timed:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+        status = 'unsolvable' if solution is None else 'solved'
+    except LevelTimeout:
+        status = 'timeout'
+    except MemoryError:
+        status = 'memory'
+    except Exception as e: # a bad level (or cache) fails only its own result
+        status = 'error'
+        error = '%s: %s' % (type(e).__name__, e)
+    finally:
+        stats['seconds'] = time.perf_counter() - begin
+        if old_limit is not None:
+            resource.setrlimit(resource.RLIMIT_AS, old_limit)
+        if cache is not None:
+            cache.close()
+    return {'name': name, 'strategy': strategy, 'status': status, 'solution': solution,
+            'moves': None if solution is None else len(solution), 'error': error, **stats}
+
+
+def solve_levels(levels, strategy='moves', workers=None, time_limit=60, memory_limit=None, report=None, cache=None):
+    '''
+    Solve a list of (name, level description) pairs (see load_levels) with
+    solve_puzzle in up to workers worker processes (default: one per core),
+    allowing each level time_limit seconds and memory_limit megabytes of
+    address space for the worker solving it.  Returns a list of result
+    dictionaries, in the order of levels, with keys 'name', 'strategy',
+    'status' ('solved', 'unsolvable', 'timeout', 'memory' or 'error'),
+    'solution', 'moves', 'error' (the exception message when status is
+    'error', otherwise None), 'expanded', 'peak_frontier' and 'seconds'.
+    report, if given, is called with each result as soon as it is ready, so
+    in the order the levels finish.  cache is the file name of a SolutionCache
+    to share between the workers, if any.
+    '''
+    memory = memory_limit and memory_limit * 2**20
+    tasks = [(name, level, strategy, time_limit, memory, cache) for name, level in levels]
+    results = [None] * len(tasks)
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        futures = {pool.submit(_solve_level, task): index for index, task in enumerate(tasks)}
+        for future in concurrent.futures.as_completed(futures):
+            result = future.result()
+            results[futures[future]] = result
+            if report is not None:
+                report(result)
+    return results
+
+
+def benchmark_strategies(levels, strategies=tuple(SOLVERS), workers=None, time_limit=60, memory_limit=None, report=None):
+    '''
+    Solve the same levels with each of the given strategies (see solve_levels)
+    and return a dictionary mapping each strategy to its results.
+    '''
+    return {strategy: solve_levels(levels, strategy, workers, time_limit, memory_limit, report)
+            for strategy in strategies}
+
+
+def _result_line(result):
+    return '%-16s %-13s %-10s %6s %12d %12d %9.2fs' % (
+        result['name'], result['strategy'], result['status'], '-' if result['moves'] is None else result['moves'],
+        result['expanded'], result['peak_frontier'], result['seconds']) + (
+        '  ' + result['error'] if result['error'] else '')
+
+
+def main(argv=None):
+    '''
+    Command line entry point; run with --help for usage.
+    '''
+    parser = argparse.ArgumentParser(description='6.009 lab 2 Snekoban solver')
+    commands = parser.add_subparsers(dest='command', required=True)
+    solve = commands.add_parser('solve', help='solve every level of a pack in parallel')
+    bench = commands.add_parser('bench', help='compare solver strategies on the levels of a pack')
+    for command in (solve, bench):
+        command.add_argument('pack', help='JSON file of levels (a list, or an object of named levels)')
+        command.add_argument('-w', '--workers', type=int, help='number of worker processes (default: one per core)')
+        command.add_argument('-t', '--time-limit', type=float, default=60, help='seconds allowed per level')
+        command.add_argument('-m', '--memory-limit', type=int, help='megabytes of address space allowed per level')
+        command.add_argument('-o', '--output', help='JSON file to write the solutions and statistics to')
+    solve.add_argument('-s', '--strategy', choices=list(SOLVERS), default='moves', help='search to use')
+    solve.add_argument('-c', '--cache', help='SQLite file to look solutions up in and store them to')
+    bench.add_argument('-s', '--strategies', choices=list(SOLVERS), nargs='+', default=list(SOLVERS),
+                       help='searches to compare')
+    args = parser.parse_args(argv)
+
+    levels = load_levels(args.pack)
+    print('%-16s %-13s %-10s %6s %12s %12s %10s' % ('level', 'strategy', 'status', 'moves', 'expanded', 'peak', 'seconds'))
+    report = lambda result: print(_result_line(result), flush=True)
+    if args.command == 'solve':
+        output = solve_levels(levels, args.strategy, args.workers, args.time_limit, args.memory_limit, report, args.cache)
+    else:
+        output = benchmark_strategies(levels, args.strategies, args.workers, args.time_limit, args.memory_limit, report)
+        print()
+        print('%-13s %8s %14s %12s' % ('strategy', 'solved', 'expanded', 'seconds'))
+        for strategy, results in output.items():
+            print('%-13s %8d %14d %11.2fs' % (strategy, sum(r['status'] == 'solved' for r in results),
+                                             sum(r['expanded'] for r in results), sum(r['seconds'] for r in results)))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+import random
+
+import pytest
+
+import lab1
+
+
+def random_image(height, width, seed):
+    rng = random.Random(seed)
+    return {'height': height, 'width': width,
+            'pixels': [rng.randint(0, 255) for _ in range(height*width)]}
+
+
+def as_list(image):
+    return {'height': image['height'], 'width': image['width'], 'pixels': list(image['pixels'])}
+
+
+def baseline_blur(image, n):
+    # the original per-pixel correlate with an n x n box kernel and 'extend'
+    height, width = image['height'], image['width']
+    k = (n-1)//2
+    pixels = []
+    for i in range(height):
+        for j in range(width):
+            total = 0
+            for a in range(n):
+                for b in range(n):
+                    total += (1/(n**2))*lab1.getpixel_1(image, i-k+a, j-k+b, 'extend')
+            pixels.append(total)
+    return pixels
+
+
+def round_and_clip(pixels):
+    return [min(255, max(0, round(p))) for p in pixels]
+
+
+def test_compact_blur_rounds_like_list():
+    image = {'height': 1, 'width': 4, 'pixels': [33, 6, 240, 132]}
+    expected = lab1.blurred(image, 6)
+    assert expected['pixels'] == [80, 96, 113, 129]
+    assert as_list(lab1.blurred(lab1.CompactImage(image), 6)) == expected
+
+
+@pytest.mark.parametrize('n', [1, 2, 3, 4, 7, 8, 15, 16, 50, 51, 100, 101])
+@pytest.mark.parametrize('size', [(1, 1), (3, 4), (6, 9)])
+def test_blur_matches_baseline_correlate(n, size):
+    image = random_image(*size, seed=n)
+    blur = baseline_blur(image, n)
+    assert lab1.blurred(image, n)['pixels'] == round_and_clip(blur)
+    sharp = [2*p - b for p, b in zip(image['pixels'], blur)]
+    assert lab1.sharpened(image, n)['pixels'] == round_and_clip(sharp)
+
+
+@pytest.mark.parametrize('n', [1, 2, 3, 4, 5, 6, 9, 10])
+@pytest.mark.parametrize('size', [(1, 4), (3, 7), (8, 5), (12, 13)])
+def test_compact_filters_match_list(n, size):
+    image = random_image(*size, seed=n)
+    compact = lab1.CompactImage(image)
+    assert as_list(lab1.blurred(compact, n)) == lab1.blurred(image, n)
+    assert as_list(lab1.sharpened(compact, n)) == lab1.sharpened(image, n)
+    kernel = [[random.Random(n).uniform(-1, 1) for _ in range(n)] for _ in range(n)]
+    for boundary in ('zero', 'extend', 'wrap'):
+        assert as_list(lab1.correlate(compact, kernel, boundary)) == lab1.correlate(image, kernel, boundary)
+
+
+@pytest.mark.parametrize('size', [(1, 1), (2, 9), (10, 11)])
+def test_compact_edges_match_list(size):
+    image = random_image(*size, seed=sum(size))
+    assert as_list(lab1.edges(lab1.CompactImage(image))) == lab1.edges(image)
+
+
+@pytest.mark.parametrize('n', [1, 2, 3, 7])
+def test_nkernel_is_a_fresh_list(n):
+    kernel = lab1.nkernel(n)
+    assert kernel == [[1/(n**2)] * n for _ in range(n)]
+    kernel[0][0] = 5
+    assert lab1.nkernel(n)[0][0] == 1/(n**2)
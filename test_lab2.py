@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+
+import collections
+
+import pytest
+
+import lab2
+
+
+# '#' wall, 'P' player, 'C' computer, 'T' target, '*' computer on a target,
+# '+' player on a target
+LEVELS = {
+    'one_push': [
+        '#####',
+        '#PCT#',
+        '#####',
+    ],
+    'already_solved': [
+        '#####',
+        '#P *#',
+        '#####',
+    ],
+    'two': [
+        '######',
+        '#    #',
+        '# CC #',
+        '#TP T#',
+        '######',
+    ],
+    'on_target': [
+        '######',
+        '#    #',
+        '# *C #',
+        '#  + #',
+        '######',
+    ],
+    'medium': [
+        '  ####   ',
+        '###  ####',
+        '#     C #',
+        '# #  #C #',
+        '# T T#P #',
+        '#########',
+    ],
+    'open': [
+        '#########',
+        '#       #',
+        '# C C C #',
+        '#  TTT  #',
+        '#   P   #',
+        '#########',
+    ],
+    'long': [
+        '############',
+        '#P         #',
+        '# ######## #',
+        '# #      # #',
+        '# # C  C # #',
+        '# #  ##  # #',
+        '#    TT    #',
+        '############',
+    ],
+    'fewer_pushes_longer': [ # 13 moves at best, but 5 pushes take 17
+        '#######',
+        '#T C  #',
+        '##    #',
+        '## C  #',
+        '#T P  #',
+        '#######',
+    ],
+    'corner_deadlock': [
+        '#####',
+        '#C T#',
+        '# P #',
+        '#####',
+    ],
+    'wall_deadlock': [
+        '#######',
+        '#T    #',
+        '# ### #',
+        '# #C  #',
+        '#   P #',
+        '#######',
+    ],
+    'frozen_pair': [
+        ' ##### ',
+        '##   # ',
+        '# C# ##',
+        '# TCT #',
+        '#  P  #',
+        '#######',
+    ],
+    'too_few_targets': [
+        '######',
+        '#    #',
+        '# CC #',
+        '#P  T#',
+        '######',
+    ],
+}
+
+CELLS = {'#': ['wall'], 'P': ['player'], 'C': ['computer'], 'T': ['target'],
+         '*': ['target', 'computer'], '+': ['target', 'player'], ' ': []}
+
+
+def description(name):
+    return [[CELLS[c] for c in row] for row in LEVELS[name]]
+
+
+def replay(name, moves):
+    '''Play moves from the start of a level; returns (final game, number of pushes).'''
+    game = lab2.new_game(description(name))
+    pushes = 0
+    for move in moves:
+        new = lab2.step_game(game, move)
+        pushes += new['computers'] != game['computers']
+        game = new
+    return game, pushes
+
+
+def reference_search(name, push_cost):
+    '''
+    Fewest moves (push_cost 1) or fewest pushes (push_cost 0 for plain walking
+    moves) to solve a level, by a plain 0-1 breadth-first search through
+    step_game; None if it cannot be solved.
+    '''
+    game = lab2.new_game(description(name))
+    best = {(game['player'], game['computers']): 0}
+    queue = collections.deque([(0, game)])
+    while queue:
+        cost, game = queue.popleft()
+        if cost > best[game['player'], game['computers']]:
+            continue
+        if lab2.victory_check(game):
+            return cost
+        for direction in lab2.direction_vector:
+            new = lab2.step_game(game, direction)
+            pushed = new['computers'] != game['computers']
+            step = 1 if pushed or push_cost else 0
+            key = (new['player'], new['computers'])
+            if key not in best or cost + step < best[key]:
+                best[key] = cost + step
+                if step:
+                    queue.append((cost + step, new))
+                else:
+                    queue.appendleft((cost, new))
+    return None
+
+
+@pytest.mark.parametrize('strategy', list(lab2.SOLVERS))
+@pytest.mark.parametrize('name', list(LEVELS))
+def test_solutions_replay_to_victory(name, strategy):
+    solution = lab2.solve_puzzle(lab2.new_game(description(name)), strategy)
+    if reference_search(name, 1) is None:
+        assert solution is None
+    else:
+        assert lab2.victory_check(replay(name, solution)[0])
+
+
+@pytest.mark.parametrize('strategy', ['bfs', 'moves', 'bidirectional'])
+@pytest.mark.parametrize('name', list(LEVELS))
+def test_shortest_solutions(name, strategy):
+    solution = lab2.solve_puzzle(lab2.new_game(description(name)), strategy)
+    shortest = reference_search(name, 1)
+    assert (solution is None) == (shortest is None)
+    if solution is not None:
+        assert len(solution) == shortest
+
+
+@pytest.mark.parametrize('name', list(LEVELS))
+def test_fewest_pushes(name):
+    solution = lab2.solve_puzzle(lab2.new_game(description(name)), 'pushes')
+    fewest = reference_search(name, 0)
+    assert (solution is None) == (fewest is None)
+    if solution is not None:
+        game, pushes = replay(name, solution)
+        assert lab2.victory_check(game)
+        assert pushes == fewest
+
+
+@pytest.mark.parametrize('name', ['corner_deadlock', 'wall_deadlock', 'frozen_pair', 'too_few_targets'])
+def test_deadlocked_levels_have_no_solution(name):
+    assert reference_search(name, 1) is None
+    for strategy in lab2.SOLVERS:
+        assert lab2.solve_puzzle(lab2.new_game(description(name)), strategy) is None